@@ -1,21 +1,37 @@
 import argparse
+import atexit
 import fnmatch
+import hashlib
+import importlib
+import json
 import logging
 import math
 import os
 import random
 import re
+import struct
 import subprocess
 import sys
+import threading
 import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context, shared_memory
 from dataclasses import dataclass, field
 from logging.handlers import RotatingFileHandler
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import mss  # type: ignore
+import numpy as np
 import pyautogui  # type: ignore
 import pyscreeze  # type: ignore
-from PIL import Image
+try:
+    cv2: Any = importlib.import_module("cv2")
+except ImportError:  # the matcher falls back to its NumPy FFT kernel
+    cv2 = None
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image, PngImagePlugin
 from Xlib import Xatom, display, X, protocol  # type: ignore
 
 # --- LOGGING SETUP ---
@@ -73,6 +89,11 @@ class BotConfiguration:
     TIMEOUT_LOBBY_JOIN: float = 10.0
     TIMEOUT_ROOM_LIST_LOAD: float = 5.0
     TIMEOUT_SCAN_IDLE: float = 20.0
+    # Restart early when the picture stops changing in a state that should be animating.
+    FREEZE_DETECTION: bool = True
+    FREEZE_TIMEOUT_RUNNING: float = 60.0
+    FREEZE_TIMEOUT_GAME_STARTUP: float = 120.0
+    FREEZE_MOTION_THRESHOLD: float = 0.5
     TIMEOUT_VERIFY_UI: float = 2.0
 
     # Wait Constants
@@ -84,6 +105,62 @@ class BotConfiguration:
     CONF_LOOSE: float = 0.68
     CONF_POPUP: float = 0.85
     CONF_VERIFY_ACTION: float = 0.80
+    PYRAMID_MIN_AREA: int = 40000
+    PYRAMID_MIN_SIDE: int = 24
+    PYRAMID_MAX_LEVEL: int = 3
+    PYRAMID_COARSE_THRESHOLD: float = 0.60
+    PYRAMID_MAX_CANDIDATES: int = 6
+    FFT_COST_FACTOR: float = 0.5
+    # Worker processes for the batched per-frame pass; 0 matches in-process.
+    MATCH_WORKERS: int = 0
+    # Threads for the same pass when no worker processes are used; 0 or 1 matches on the loop thread.
+    MATCH_THREADS: int = 0
+    MATCH_BAND_MIN_AREA: int = 4096
+    # "auto" benchmarks every available backend on the first frame of the session; or pin one of VISION_BACKENDS.
+    VISION_BACKEND: str = "auto"
+    BACKEND_CALIBRATION_ROUNDS: int = 2
+    SPECTRUM_CACHE_MB: int = 256
+    COLOR_GATE: bool = True
+    COLOR_GATE_MIN_SHARE: float = 0.20
+    COLOR_GATE_GRID_STEP: int = 2
+    PRIOR_MIN_SAMPLES: int = 3
+    PRIOR_MARGIN_RATIO: float = 0.05
+    VISION_STATE_PATH: str = "vision_state.json"
+    TEMPLATE_PACK_PATH: str = "templates.pack"
+    TEMPLATE_REFERENCE_SIZE: Optional[Tuple[int, int]] = None
+    RESCALE_TOLERANCE: float = 0.02
+    RESCALE_CACHE_SIZE: int = 4
+    RESCALE_CACHE_DIR: Optional[str] = None
+    VISION_STATE_SAVE_INTERVAL: float = 120.0
+    NMS_OVERLAP: float = 0.30
+    TILE_GATING: bool = True
+    TILE_SIZE: int = 32
+    TILE_MAX_DIRTY_SHARE: float = 0.5
+    MASK_MERGE_MIN_SCORE: float = 0.90
+    MASK_MERGE_TOLERANCE: int = 24
+    MASK_MERGE_MIN_KEEP: float = 0.5
+    VARIANT_DEAD_MIN_HITS: int = 50
+    HYSTERESIS_MARGIN: float = 0.04
+    HYSTERESIS_HOLD: float = 2.0
+    # find_stable_image: the N frames a key must be present on are taken from this many recent captures,
+    # all captured within FRAME_STABILITY_WINDOW seconds and spread over at least FRAME_STABILITY_MIN_SPAN.
+    FRAME_RING_SIZE: int = 8
+    FRAME_STABILITY_WINDOW: float = 0.75
+    FRAME_STABILITY_MIN_SPAN: float = 0.2
+    # Animation waits end once SETTLE_STILL_FRAMES consecutive thumbnail diffs stay under the motion threshold
+    # (mean absolute grayscale change, 0-255); the old fixed sleep is the upper bound.
+    SETTLE_DETECTION: bool = True
+    SETTLE_MOTION_THRESHOLD: float = 2.0
+    SETTLE_STILL_FRAMES: int = 2
+    SETTLE_POLL: float = 0.05
+    SETTLE_MIN_WAIT: float = 0.10
+    SETTLE_THUMBNAIL: int = 64
+    NEAR_MISS_HARVEST: bool = True
+    NEAR_MISS_MARGIN: float = 0.07
+    NEAR_MISS_CONFIRM_WINDOW: float = 5.0
+    NEAR_MISS_DIR: str = "template_candidates"
+    NEAR_MISS_DUPLICATE_SCORE: float = 0.97
+    NEAR_MISS_MAX_PER_KEY: int = 5
 
     # Logic
     AUTO_ICON_DEDUPE_DIST: int = 60
@@ -293,6 +370,1671 @@ def apply_cpu_affinity(value):
         logger.warning(f"CPU affinity '{value}' could not be applied: {e}")
 
 
+def available_cpus():
+    """CPUs this process may run on, i.e. the set apply_cpu_affinity left it with."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_pool_size(value):
+    return available_cpus() if value.strip().lower() == "auto" else max(0, int(value))
+
+
+def parse_window_size(value):
+    """WIDTHxHEIGHT, e.g. 806x482, as an (int, int) pair."""
+    width, sep, height = value.strip().lower().partition("x")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
+    return int(width), int(height)
+
+
+def rgb_to_gray(rgb):
+    """Fixed-point BT.601 luma; bit-identical to the cv2 conversion pyscreeze does before matching."""
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    return ((rgb[..., 0] * 4899 + rgb[..., 1] * 9617 + rgb[..., 2] * 1868 + 8192) >> 14).astype(np.uint8)
+
+
+def fft_size(n):
+    """Smallest 2^a * 3^b * 5^c >= n (pocketfft is much faster on these lengths)."""
+    best = 1 << max(0, (n - 1).bit_length())
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def normalize_ncc(num, denom):
+    """Apply cv2's TM_CCOEFF_NORMED edge rules so scores match pyscreeze exactly."""
+    mag = np.abs(num)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(mag < denom, num / denom, 0.0)
+    edge = (mag >= denom) & (mag < denom * 1.125)
+    scores[edge] = np.sign(num[edge])
+    return scores
+
+
+def color_bins(rgb):
+    """512-bin colour index (3 bits per channel) of an RGB uint8 array."""
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    return (rgb[..., 0] >> 5).astype(np.int32) * 64 + (rgb[..., 1] >> 5) * 8 + (rgb[..., 2] >> 5)
+
+
+def color_presence(rgb, step):
+    """Which colour bins occur on a coarse pixel grid, dilated by one bin per channel for quantisation edges."""
+    present = np.zeros(512, dtype=bool)
+    present[color_bins(rgb[::step, ::step])] = True
+    cube = np.pad(present.reshape(8, 8, 8), 1)
+    dilated = np.zeros((8, 8, 8), dtype=bool)
+    for dr in range(3):
+        for dg in range(3):
+            for db in range(3):
+                dilated |= cube[dr:dr + 8, dg:dg + 8, db:db + 8]
+    return dilated.ravel()
+
+
+def tile_hashes(pixels, tile):
+    """64-bit hash per tile x tile block (tile a multiple of 8); edge tiles are zero padded."""
+    h, w = pixels.shape[:2]
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    ty, tx = -(-h // tile), -(-w // tile)
+    padded = np.zeros((ty * tile, tx * tile * channels), dtype=np.uint8)
+    padded[:h, :w * channels] = pixels.reshape(h, w * channels)
+    words = padded.reshape(ty, tile, tx, tile * channels).view(np.uint64)
+    weights = np.random.default_rng(0x7113).integers(1, 2**63, size=(tile, words.shape[3]), dtype=np.uint64) | np.uint64(1)
+    # Random odd weights mod 2^64; uint64 wraparound is the intended arithmetic.
+    return (words * weights[None, :, None, :]).sum(axis=(1, 3), dtype=np.uint64)
+
+
+def downscale2(gray):
+    h, w = gray.shape[0] // 2, gray.shape[1] // 2
+    return gray[:2 * h, :2 * w].reshape(h, 2, w, 2).mean(axis=(1, 3))
+
+
+def suppress_overlaps(boxes, scores=None, overlap=0.3):
+    """Greedy NMS over (N, 4) left/top/width/height boxes; indices kept, best first (input order without scores)."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    order = np.arange(len(boxes)) if scores is None else np.argsort(-np.asarray(scores), kind="stable")
+    x0, y0 = boxes[order, 0], boxes[order, 1]
+    x1, y1 = x0 + boxes[order, 2], y0 + boxes[order, 3]
+    area = boxes[order, 2] * boxes[order, 3]
+    alive = np.ones(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if not alive[i]:
+            continue
+        keep.append(order[i])
+        rest = np.flatnonzero(alive[i + 1:]) + i + 1
+        iw = np.clip(np.minimum(x1[i], x1[rest]) - np.maximum(x0[i], x0[rest]), 0, None)
+        ih = np.clip(np.minimum(y1[i], y1[rest]) - np.maximum(y0[i], y0[rest]), 0, None)
+        inter = iw * ih
+        alive[rest[inter > overlap * (area[i] + area[rest] - inter)]] = False
+    return np.asarray(keep, dtype=np.int64)
+
+
+def suppress_near_centers(centers, radius):
+    """First-come suppression of (N, 2) centers closer than radius to a kept one."""
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    alive = np.ones(len(centers), dtype=bool)
+    keep = []
+    for i in range(len(centers)):
+        if not alive[i]:
+            continue
+        keep.append(i)
+        d2 = ((centers[i + 1:] - centers[i]) ** 2).sum(axis=1)
+        alive[i + 1:] &= d2 >= radius * radius
+    return np.asarray(keep, dtype=np.int64)
+
+
+class TemplateImage:
+    """One template variant with its NCC statistics precomputed; with a mask only the pixels under it count."""
+
+    def __init__(self, path, rgb=None, gray=None, zero_mean=None, norm=None, mask=None):
+        self.path = path
+        self.rgb = rgb
+        self.gray = rgb_to_gray(rgb).astype(np.float64) if gray is None else gray
+        self.height, self.width = self.gray.shape
+        if mask is not None and np.all(mask):
+            mask = None
+        if mask is not None and not np.any(mask):
+            raise ValueError(f"{path}: mask hides every pixel")
+        self.mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self.mask_key = None if mask is None else (self.height, self.width, hashlib.sha1(np.ascontiguousarray(self.mask)).hexdigest())
+        if zero_mean is None:
+            if self.mask is None:
+                zero_mean = self.gray - self.gray.mean()
+            else:
+                zero_mean = (self.gray - self.gray[self.mask].mean()) * self.mask
+        self.zero_mean = zero_mean
+        self.norm = float(np.sqrt(np.square(self.zero_mean).sum())) if norm is None else norm
+        self.dominant_colors = None
+        self._levels = {}
+
+    @property
+    def image(self):
+        return Image.fromarray(np.ascontiguousarray(self.rgb)) if self.rgb is not None else None
+
+    def level(self, n):
+        """This template downscaled n times by 2x2 averaging (unmasked templates only)."""
+        if n == 0:
+            return self
+        if n not in self._levels:
+            self._levels[n] = TemplateImage(self.path, gray=downscale2(self.level(n - 1).gray))
+        return self._levels[n]
+
+
+class HaystackImage:
+    """Grayscale haystack with integral images of I and I^2 for O(1) window statistics."""
+
+    def __init__(self, gray, rgb=None):
+        self.gray = gray
+        self.rgb = rgb
+        self._color_presence = None
+        self.height, self.width = self.gray.shape
+        # Integral images and narrower copies are built on first use; most lookups need only some of them.
+        self._integral = None
+        self._integral_sq = None
+        self._gray8 = None
+        self._match_plane = None
+        self._spectra = {}
+        self._window_norms = {}
+        self._levels = {}
+        self._tiles = {}
+
+    @property
+    def integral(self):
+        if self._integral is None:
+            integral = np.zeros((self.height + 1, self.width + 1))
+            np.cumsum(np.cumsum(self.gray, axis=0), axis=1, out=integral[1:, 1:])
+            self._integral = integral
+        return self._integral
+
+    @property
+    def integral_sq(self):
+        if self._integral_sq is None:
+            integral = np.zeros((self.height + 1, self.width + 1))
+            np.cumsum(np.cumsum(np.square(self.gray), axis=0), axis=1, out=integral[1:, 1:])
+            self._integral_sq = integral
+        return self._integral_sq
+
+    @property
+    def gray8(self):
+        if self._gray8 is None:
+            self._gray8 = np.clip(self.gray, 0, 255).astype(np.uint8)
+        return self._gray8
+
+    @property
+    def match_plane(self):
+        """What cv2.matchTemplate reads: 8-bit gray for a captured frame, float32 for pyramid levels and templates."""
+        if self._match_plane is None:
+            self._match_plane = self.gray8 if self.rgb is not None else self.gray.astype(np.float32)
+        return self._match_plane
+
+    def color_presence(self, step):
+        if self._color_presence is None and self.rgb is not None:
+            self._color_presence = color_presence(self.rgb, step)
+        return self._color_presence
+
+    def tile_hashes(self, tile):
+        if tile not in self._tiles:
+            self._tiles[tile] = tile_hashes(self.rgb if self.rgb is not None else self.gray8, tile)
+        return self._tiles[tile]
+
+    def level(self, n):
+        """Pyramid level n, built once per snapshot and shared by every template that needs it."""
+        if n == 0:
+            return self
+        if n not in self._levels:
+            self._levels[n] = HaystackImage(downscale2(self.level(n - 1).gray))
+        return self._levels[n]
+
+    @staticmethod
+    def window_sums(integral, h, w):
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    def window_norms(self, h, w):
+        """sqrt(sum((I - mean)^2)) for every h x w window, shared by templates of the same size."""
+        if (h, w) not in self._window_norms:
+            sums = self.window_sums(self.integral, h, w)
+            var = self.window_sums(self.integral_sq, h, w) - sums * sums / (h * w)
+            self._window_norms[(h, w)] = np.sqrt(np.maximum(var, 0.0))
+        return self._window_norms[(h, w)]
+
+    def masked_window_norms(self, mask, key):
+        """window_norms counting only the pixels under mask, via FFT correlations of I and I^2 with it."""
+        if key not in self._window_norms:
+            h, w = mask.shape
+            shape = (fft_size(self.height), fft_size(self.width))
+            if ("sq", shape) not in self._spectra:
+                self._spectra[("sq", shape)] = np.fft.rfft2(np.square(self.gray), shape)
+            kernel = np.conj(np.fft.rfft2(mask.astype(np.float64), shape))
+            out = (slice(0, self.height - h + 1), slice(0, self.width - w + 1))
+            sums = np.fft.irfft2(self.spectrum(shape) * kernel, shape)[out]
+            sums_sq = np.fft.irfft2(self._spectra[("sq", shape)] * kernel, shape)[out]
+            var = sums_sq - sums * sums / mask.sum()
+            # Integer pixels: a window that is not flat has variance >= 1 - 1/n, so smaller is FFT noise.
+            var[var < 0.25] = 0.0
+            self._window_norms[key] = np.sqrt(var)
+        return self._window_norms[key]
+
+    def spectrum(self, shape):
+        if shape not in self._spectra:
+            self._spectra[shape] = np.fft.rfft2(self.gray, shape)
+        return self._spectra[shape]
+
+
+class Frame:
+    """One captured window image whose RGB, grayscale, pyramid and integral views are built on first use and shared."""
+
+    def __init__(self, rgb, captured_at=None):
+        self.rgb = rgb
+        self.captured_at = time.time() if captured_at is None else captured_at
+        self.height, self.width = rgb.shape[:2]
+        self._image = None
+        self._haystack = None
+        self._thumbnails = {}
+
+    @classmethod
+    def from_image(cls, image, captured_at=None):
+        image = image if image.mode == "RGB" else image.convert("RGB")
+        frame = cls(np.asarray(image), captured_at)
+        frame._image = image
+        return frame
+
+    @classmethod
+    def from_grab(cls, shot):
+        """An mss screenshot, viewed as RGB without a round trip through PIL."""
+        bgra = np.frombuffer(shot.bgra, dtype=np.uint8).reshape(shot.size[1], shot.size[0], 4)
+        return cls(np.ascontiguousarray(bgra[..., 2::-1]))
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Image.fromarray(self.rgb)
+        return self._image
+
+    @property
+    def haystack(self):
+        if self._haystack is None:
+            self._haystack = HaystackImage(rgb_to_gray(self.rgb).astype(np.float64), self.rgb)
+        return self._haystack
+
+    def thumbnail(self, side, roi=None):
+        """side x side grayscale of the frame, or of roi given as (x0, y0, x1, y1) fractions of it."""
+        if (side, roi) not in self._thumbnails:
+            rgb = self.rgb
+            if roi is not None:
+                y0, x0 = int(roi[1] * self.height), int(roi[0] * self.width)
+                rgb = rgb[y0:max(y0 + 1, int(roi[3] * self.height)), x0:max(x0 + 1, int(roi[2] * self.width))]
+            small = Image.fromarray(rgb).convert("L").resize((side, side), Image.BOX)
+            self._thumbnails[(side, roi)] = np.asarray(small, dtype=np.float32)
+        return self._thumbnails[(side, roi)]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.rgb if dtype is None else self.rgb.astype(dtype)
+
+    def save(self, path):
+        self.image.save(path)
+
+
+class FrameRing:
+    """Capture time and the best score of every key checked, for the last few frames (held weakly)."""
+
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)
+
+    def push(self, frame):
+        self.entries.append((weakref.ref(frame), frame.captured_at, {}))
+
+    def scores(self, frame):
+        for ref, _, scores in reversed(self.entries):
+            if ref() is frame:
+                return scores
+        return None
+
+    def record(self, frame, key, score):
+        scores = self.scores(frame)
+        if scores is not None:
+            scores[key] = score
+
+    def streak(self, key, enter, exit, window, now=None):
+        """(frames, seconds) of the newest run within window above exit, counted back to the frame it last cleared enter on."""
+        now = time.time() if now is None else now
+        streak = run = 0
+        newest = oldest = None
+        for _, captured_at, scores in reversed(self.entries):
+            score = scores.get(key)
+            if now - captured_at > window or score is None or score <= exit:
+                break
+            run += 1
+            newest = captured_at if newest is None else newest
+            if score > enter:
+                streak, oldest = run, captured_at
+        return streak, (newest - oldest) if streak else 0.0
+
+
+class VisionBackend:
+    """The kernel TemplateMatcher scores unmasked templates with, behind its shared colour, pyramid and mask routing."""
+
+    name = ""
+    # False for a reference route that scores every template in full, skipping the colour gate and the pyramid.
+    gated = True
+
+    def available(self):
+        return True
+
+    def dense(self, matcher, hay, tpls, cache=True):
+        """Every position's score for each template; all of them fit the haystack."""
+        raise NotImplementedError
+
+    def region(self, matcher, hay, tpl, roi):
+        """Scores for the top-left positions in roi, already clipped to the haystack."""
+        raise NotImplementedError
+
+
+class NumpyBackend(VisionBackend):
+    """The matcher's FFT kernel, with its spectrum cache and FFT-versus-direct cost model."""
+
+    name = "numpy"
+
+    def dense(self, matcher, hay, tpls, cache=True):
+        return matcher.fft_scores(hay, tpls, cache)
+
+    def region(self, matcher, hay, tpl, roi):
+        return matcher.fft_region(hay, tpl, roi)
+
+
+class OpenCVBackend(VisionBackend):
+    """cv2.matchTemplate on the haystack's cached gray plane."""
+
+    name = "opencv"
+
+    def available(self):
+        return cv2 is not None
+
+    def plane(self, hay):
+        return hay.match_plane
+
+    def needle(self, tpl, dtype):
+        return tpl.gray.astype(dtype)
+
+    def dense(self, matcher, hay, tpls, cache=True):
+        plane = self.plane(hay)
+        return [cv2.matchTemplate(plane, self.needle(t, plane.dtype), cv2.TM_CCOEFF_NORMED).astype(np.float64) for t in tpls]
+
+    def region(self, matcher, hay, tpl, roi):
+        x0, y0, x1, y1 = roi
+        plane = self.plane(hay)[y0:y1 + tpl.height - 1, x0:x1 + tpl.width - 1]
+        return cv2.matchTemplate(plane, self.needle(tpl, plane.dtype), cv2.TM_CCOEFF_NORMED).astype(np.float64)
+
+
+class PyscreezeBackend(OpenCVBackend):
+    """What pyscreeze.locateAll computes: the ungated reference route, converting both images on every call."""
+
+    name = "pyscreeze"
+    gated = False
+
+    def plane(self, hay):
+        return self.convert(Image.fromarray(hay.rgb)) if hay.rgb is not None else hay.match_plane
+
+    def needle(self, tpl, dtype):
+        return self.convert(tpl.image) if tpl.rgb is not None and dtype == np.uint8 else tpl.gray.astype(dtype)
+
+    @staticmethod
+    def convert(image):
+        # pyscreeze's grayscale route for a PIL image: an RGB -> BGR copy, then cv2's BGR -> gray.
+        return cv2.cvtColor(np.array(image.convert("RGB"))[:, :, ::-1].copy(), cv2.COLOR_BGR2GRAY)
+
+
+# Selectable with --vision-backend; "auto" times the available ones and keeps the fastest that finds every calibration paste.
+VISION_BACKENDS = {b.name: b for b in (PyscreezeBackend(), NumpyBackend(), OpenCVBackend())}
+
+
+class TemplateMatcher:
+    """TM_CCOEFF_NORMED engine behind find_image/find_all (same scores as pyscreeze's grayscale cv2 path)."""
+
+    def __init__(self, config=None):
+        self.config = config or BotConfiguration()
+        self.stats = {}
+        # (id(template), fft shape) -> (template, conj spectrum); the template is held so its id stays unique.
+        self._spectra = OrderedDict()
+        self._spectra_bytes = 0
+        # Guards the spectrum cache and stats when a MatchThreadPool scores on several threads.
+        self._lock = threading.Lock()
+        self.backend = VISION_BACKENDS["opencv" if cv2 is not None else "numpy"]
+
+    def template_spectrum(self, tpl, shape, cache=True):
+        """conj(rfft2(T')) at an FFT shape, cached per template and window size within SPECTRUM_CACHE_MB."""
+        key = (id(tpl), shape)
+        with self._lock:
+            if key in self._spectra:
+                self._spectra.move_to_end(key)
+                return self._spectra[key][1]
+        spectrum = np.conj(np.fft.rfft2(tpl.zero_mean, shape))
+        if cache:
+            with self._lock:
+                if key not in self._spectra:
+                    self._spectra[key] = (tpl, spectrum)
+                    self._spectra_bytes += spectrum.nbytes
+                while self._spectra_bytes > self.config.SPECTRUM_CACHE_MB << 20 and len(self._spectra) > 1:
+                    self._spectra_bytes -= self._spectra.popitem(last=False)[1][1].nbytes
+        return spectrum
+
+    def prefer_fft(self, positions, h, w, shape):
+        """Cost model: direct NCC costs ~h*w per position, an FFT correlation ~N log2 N for its padded shape."""
+        n = shape[0] * shape[1]
+        return positions * h * w > self.config.FFT_COST_FACTOR * n * math.log2(max(n, 2))
+
+    def prepare(self, tpl):
+        """Precompute per-template data the matcher uses (called from _load_templates)."""
+        if tpl.dominant_colors is None and tpl.mask is not None:
+            # The masked-out background may be any colour, so masked templates are never gated.
+            tpl.dominant_colors = np.empty(0, dtype=np.int64)
+        if tpl.dominant_colors is None and tpl.rgb is not None:
+            tpl.dominant_colors = self.dominant_colors(tpl)
+        return tpl
+
+    def dominant_colors(self, tpl):
+        """Colour bins holding COLOR_GATE_MIN_SHARE of the template at every grid phase, so its own copy always passes."""
+        rgb = tpl.rgb
+        counts = np.bincount(color_bins(rgb).ravel(), minlength=512)
+        dominant = np.flatnonzero(counts >= self.config.COLOR_GATE_MIN_SHARE * counts.sum())
+        step = self.config.COLOR_GATE_GRID_STEP
+        for dy in range(step):
+            for dx in range(step):
+                if not color_presence(rgb[dy:, dx:], step)[dominant].all():
+                    return np.empty(0, dtype=np.int64)
+        return dominant
+
+    def passes_color_gate(self, hay, tpl):
+        if not self.config.COLOR_GATE or tpl.dominant_colors is None or not len(tpl.dominant_colors):
+            return True
+        present = hay.color_presence(self.config.COLOR_GATE_GRID_STEP)
+        if present is None or present[tpl.dominant_colors].all():
+            return True
+        self._count("color_rejects")
+        return False
+
+    @staticmethod
+    def window_norms(hay, tpl):
+        if tpl.mask is None:
+            return hay.window_norms(tpl.height, tpl.width)
+        return hay.masked_window_norms(tpl.mask, tpl.mask_key)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + n
+
+    @staticmethod
+    def haystack(image):
+        # Frames carry their own converted views; a bare image is wrapped (and converted) per call.
+        return (image if isinstance(image, Frame) else Frame.from_image(image)).haystack
+
+    def pyramid_level(self, tpl):
+        if tpl.mask is not None or tpl.height * tpl.width < self.config.PYRAMID_MIN_AREA:
+            return 0
+        level = 0
+        while level < self.config.PYRAMID_MAX_LEVEL and min(tpl.height, tpl.width) >> (level + 1) >= self.config.PYRAMID_MIN_SIDE:
+            level += 1
+        return level
+
+    def score_map(self, hay, tpl):
+        return self.score_maps(hay, [tpl])[0]
+
+    def score_maps(self, hay, tpls):
+        """Score maps for several templates: gated and routed here, scored by the selected backend's kernel."""
+        results, dense, masked = [None] * len(tpls), [], []
+        gated = self.backend.gated
+        for i, t in enumerate(tpls):
+            if t.height > hay.height or t.width > hay.width:
+                continue
+            if gated and not self.passes_color_gate(hay, t):
+                results[i] = np.full((hay.height - t.height + 1, hay.width - t.width + 1), -1.0)
+                continue
+            level = self.pyramid_level(t) if gated else 0
+            if level:
+                results[i] = self.score_pyramid(hay, t, level)
+            elif t.mask is not None:
+                masked.append(i)
+            else:
+                dense.append(i)
+        if dense:
+            for i, scores in zip(dense, self.backend.dense(self, hay, [tpls[i] for i in dense])):
+                results[i] = scores
+        if masked:
+            for i, scores in zip(masked, self.fft_scores(hay, [tpls[i] for i in masked])):
+                results[i] = scores
+        return results
+
+    def score_region(self, hay, tpl, roi):
+        """Score only top-left positions x0 <= x < x1, y0 <= y < y1 of the haystack."""
+        x0, y0, x1, y1 = roi
+        x1, y1 = min(x1, hay.width - tpl.width + 1), min(y1, hay.height - tpl.height + 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        if self.backend.gated and not self.passes_color_gate(hay, tpl):
+            return np.full((y1 - y0, x1 - x0), -1.0)
+        if tpl.mask is not None:
+            return self.fft_region(hay, tpl, (x0, y0, x1, y1))
+        return self.backend.region(self, hay, tpl, (x0, y0, x1, y1))
+
+    def fft_scores(self, hay, tpls, cache=True, batch=8):
+        """Full score maps from the FFT kernel, one stacked inverse FFT per batch of templates."""
+        results = []
+        shape = (fft_size(hay.height), fft_size(hay.width))
+        for start in range(0, len(tpls), batch):
+            chunk = tpls[start:start + batch]
+            # sum(T') == 0, so sum(T' * I) equals the mean-subtracted numerator.
+            stack = np.stack([self.template_spectrum(t, shape, cache) for t in chunk])
+            nums = np.fft.irfft2(stack * hay.spectrum(shape), shape)
+            results += [self._normalize(hay, t, num) for t, num in zip(chunk, nums)]
+        return results
+
+    def score_pyramid(self, hay, tpl, level):
+        """Coarse-to-fine search refined in a 5x5 block per level; positions never visited score -1."""
+        scores = np.full((hay.height - tpl.height + 1, hay.width - tpl.width + 1), -1.0)
+        coarse_hay, coarse_tpl = hay.level(level), tpl.level(level)
+        if coarse_tpl.height > coarse_hay.height or coarse_tpl.width > coarse_hay.width:
+            return self.dense_scores(hay, tpl)
+        threshold = self.config.PYRAMID_COARSE_THRESHOLD
+        coarse = self.dense_scores(coarse_hay, coarse_tpl)
+        separation = max(1, min(coarse_tpl.height, coarse_tpl.width) // 4)
+        for y, x in self._peaks(coarse, threshold, self.config.PYRAMID_MAX_CANDIDATES, separation):
+            for n in range(level - 1, -1, -1):
+                lvl_hay, lvl_tpl = hay.level(n), tpl.level(n)
+                roi = (max(0, 2 * x - 2), max(0, 2 * y - 2), 2 * x + 3, 2 * y + 3)
+                block = self.score_block(lvl_hay, lvl_tpl, roi)
+                if block is None:
+                    break
+                if n == 0:
+                    scores[roi[1]:roi[1] + block.shape[0], roi[0]:roi[0] + block.shape[1]] = block
+                    break
+                by, bx = np.unravel_index(int(np.argmax(block)), block.shape)
+                if block[by, bx] <= threshold:
+                    break
+                y, x = roi[1] + int(by), roi[0] + int(bx)
+        return scores
+
+    @staticmethod
+    def _peaks(scores, threshold, limit, separation=1):
+        idx = np.flatnonzero(scores > threshold)
+        idx = idx[np.argsort(scores.ravel()[idx])[::-1]]
+        peaks = []
+        for y, x in zip(*np.unravel_index(idx, scores.shape)):
+            if all(abs(int(y) - py) > separation or abs(int(x) - px) > separation for py, px in peaks):
+                peaks.append((int(y), int(x)))
+                if len(peaks) >= limit:
+                    break
+        return peaks
+
+    def dense_scores(self, hay, tpl, cache=True):
+        """Every position's score for one template, ungated: the backend's kernel, or the FFT kernel for a mask."""
+        if tpl.mask is not None:
+            return self.fft_scores(hay, [tpl], cache)[0]
+        return self.backend.dense(self, hay, [tpl], cache)[0]
+
+    @staticmethod
+    def score_block(hay, tpl, roi):
+        """Direct spatial NCC for a small block of top-left positions (cheaper than an FFT for a few dozen)."""
+        h, w = tpl.height, tpl.width
+        x0, y0 = roi[0], roi[1]
+        x1, y1 = min(roi[2], hay.width - w + 1), min(roi[3], hay.height - h + 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        windows = sliding_window_view(hay.gray[y0:y1 + h - 1, x0:x1 + w - 1], (h, w))
+        num = np.einsum("abij,ij->ab", windows, tpl.zero_mean)
+        if tpl.norm < 1e-12:
+            return np.ones_like(num)
+        return normalize_ncc(num, TemplateMatcher.window_norms(hay, tpl)[y0:y1, x0:x1] * tpl.norm)
+
+    def fft_region(self, hay, tpl, roi):
+        """score_region through the FFT kernel, or direct NCC when the cost model says that is cheaper."""
+        x0, y0, x1, y1 = roi
+        h, w = tpl.height, tpl.width
+        crop = hay.gray[y0:y1 + h - 1, x0:x1 + w - 1]
+        shape = (fft_size(crop.shape[0]), fft_size(crop.shape[1]))
+        if not self.prefer_fft((y1 - y0) * (x1 - x0), h, w, shape):
+            return self.score_block(hay, tpl, (x0, y0, x1, y1))
+        # Crop shapes vary with the region, so these spectra are not worth caching.
+        product = np.fft.rfft2(crop, shape) * self.template_spectrum(tpl, shape, cache=False)
+        num = np.fft.irfft2(product, shape)[:y1 - y0, :x1 - x0]
+        if tpl.norm < 1e-12:
+            return np.ones_like(num)
+        return normalize_ncc(num, self.window_norms(hay, tpl)[y0:y1, x0:x1] * tpl.norm)
+
+    @staticmethod
+    def _normalize(hay, tpl, num):
+        h, w = tpl.height, tpl.width
+        out_h, out_w = hay.height - h + 1, hay.width - w + 1
+        if tpl.norm < 1e-12:
+            return np.ones((out_h, out_w))
+        return normalize_ncc(num[:out_h, :out_w], TemplateMatcher.window_norms(hay, tpl) * tpl.norm)
+
+    def locate_all(self, tpl, image, confidence, limit=10000):
+        scores = self.score_map(self.haystack(image), tpl)
+        if scores is None:
+            return []
+        idx = np.flatnonzero(scores > confidence)[:limit]
+        ys, xs = np.unravel_index(idx, scores.shape)
+        return [(int(x), int(y), float(scores[y, x])) for y, x in zip(ys, xs)]
+
+    def locate(self, tpl, image, confidence):
+        hits = self.locate_all(tpl, image, confidence, limit=1)
+        return hits[0] if hits else None
+
+
+TEMPLATE_PACK_MAGIC = b"BBSPACK\0"
+TEMPLATE_PACK_VERSION = 2
+
+
+def discover_template_variants(path):
+    """The template (or its _masked merge) followed by its _bk* variants in filename order."""
+    directory = os.path.dirname(path)
+    root, ext = os.path.splitext(os.path.basename(path))
+    alts = sorted(f for f in fnmatch.filter(os.listdir(directory or "."), root + "_bk*" + ext) if not f.endswith("_mask" + ext))
+    variants = [path] + [os.path.join(directory, alt) for alt in alts]
+    masked = os.path.join(directory, root + "_masked" + ext)
+    if os.path.exists(masked):
+        with Image.open(masked) as image:
+            merged = set(json.loads(image.text.get("merged", "[]")))
+        variants = [masked] + [v for v in variants if os.path.basename(v) not in merged]
+    return variants
+
+
+def load_template_image(path):
+    """Decode a template; transparent pixels, or black pixels of a companion <name>_mask file, are ignored."""
+    with Image.open(path) as image:
+        mask = None
+        if "A" in image.getbands():
+            alpha = np.asarray(image.getchannel("A"))
+            mask = alpha >= 128 if alpha.min() < 128 else None
+        rgb = np.asarray(image.convert("RGB"))
+    root, ext = os.path.splitext(path)
+    if mask is None and os.path.exists(root + "_mask" + ext):
+        with Image.open(root + "_mask" + ext) as image:
+            mask = np.asarray(image.convert("L")) >= 128
+    return TemplateImage(path, rgb, mask=mask)
+
+
+def align_template(matcher, base, variant, core=0.6):
+    """(dx, dy, score): where base's top-left falls inside variant, found by locating base's central core there."""
+    ch, cw = max(1, int(base.height * core)), max(1, int(base.width * core))
+    cy, cx = (base.height - ch) // 2, (base.width - cw) // 2
+    if ch > variant.height or cw > variant.width:
+        return None
+    piece = TemplateImage(base.path, gray=base.gray[cy:cy + ch, cx:cx + cw],
+                          mask=None if base.mask is None else base.mask[cy:cy + ch, cx:cx + cw])
+    hay = HaystackImage(variant.gray)
+    scores = matcher.dense_scores(hay, piece, cache=False)
+    y, x = np.unravel_index(int(np.argmax(scores)), scores.shape)
+    return int(x) - cx, int(y) - cy, float(scores[y, x])
+
+
+def merge_masked_template(config, paths, matcher=None):
+    """(rgb, mask, merged, kept separate) folding same-scale variants into the first template, or None."""
+    matcher = matcher or TemplateMatcher(config)
+    base = load_template_image(paths[0])
+    x0, y0, x1, y1 = 0, 0, base.width, base.height
+    keep = np.ones(base.gray.shape, dtype=bool) if base.mask is None else base.mask.copy()
+    folded, separate = [], []
+    for path in paths[1:]:
+        variant = load_template_image(path)
+        found = align_template(matcher, base, variant)
+        if found is None or found[2] < config.MASK_MERGE_MIN_SCORE:
+            separate.append(path)
+            continue
+        dx, dy, _ = found
+        box = max(x0, -dx), max(y0, -dy), min(x1, variant.width - dx), min(y1, variant.height - dy)
+        if box[2] <= box[0] or box[3] <= box[1]:
+            separate.append(path)
+            continue
+        agree = np.zeros_like(keep)
+        other = variant.gray[box[1] + dy:box[3] + dy, box[0] + dx:box[2] + dx]
+        agree[box[1]:box[3], box[0]:box[2]] = np.abs(base.gray[box[1]:box[3], box[0]:box[2]] - other) <= config.MASK_MERGE_TOLERANCE
+        if variant.mask is not None:
+            agree[box[1]:box[3], box[0]:box[2]] &= variant.mask[box[1] + dy:box[3] + dy, box[0] + dx:box[2] + dx]
+        if (keep & agree).sum() < config.MASK_MERGE_MIN_KEEP * base.gray.size:
+            separate.append(path)
+            continue
+        keep &= agree
+        x0, y0, x1, y1 = box
+        folded.append((path, variant, dx, dy))
+    if not folded:
+        return None
+    rgb, mask = base.rgb[y0:y1, x0:x1], keep[y0:y1, x0:x1]
+    merged = TemplateImage(paths[0], rgb, mask=mask)
+    # Every absorbed image must still match the merged template where it was aligned.
+    for path, variant, dx, dy in list(folded):
+        hay = HaystackImage(variant.gray)
+        block = matcher.score_block(hay, merged, (x0 + dx, y0 + dy, x0 + dx + 1, y0 + dy + 1))
+        if block is None or block[0, 0] <= config.MASK_MERGE_MIN_SCORE:
+            folded.remove((path, variant, dx, dy))
+            separate.append(path)
+    if not folded:
+        return None
+    return rgb, mask, [paths[0]] + [f[0] for f in folded], separate
+
+
+def merge_template_variants(config):
+    """Write <name>_masked.png for every template whose _bk variants can be folded into one masked template."""
+    matcher = TemplateMatcher(config)
+    for key, path in (config.TEMPLATES or {}).items():
+        root, ext = os.path.splitext(path)
+        variants = [v for v in discover_template_variants(path) if v != root + "_masked" + ext]
+        if len(variants) < 2:
+            continue
+        result = merge_masked_template(config, variants, matcher)
+        if result is None:
+            logger.info(f"VISION: {key}: no variant of {path} could be merged")
+            continue
+        rgb, mask, merged, separate = result
+        info = PngImagePlugin.PngInfo()
+        info.add_text("merged", json.dumps([os.path.basename(p) for p in merged]))
+        rgba = np.dstack([rgb, np.where(mask, 255, 0).astype(np.uint8)])
+        Image.fromarray(rgba, "RGBA").save(root + "_masked" + ext, pnginfo=info)
+        logger.info(
+            f"VISION: {key}: merged {len(merged)} images into {root}_masked{ext} "
+            f"({mask.mean():.0%} of pixels kept); separate: {', '.join(os.path.basename(p) for p in separate) or 'none'}"
+        )
+
+
+def paste_template(rgb, tpl, rng, noise=0.0):
+    """A copy of rgb with tpl pasted at a random spot, plus Gaussian noise; returns (frame, (x, y))."""
+    y, x = int(rng.integers(0, rgb.shape[0] - tpl.height + 1)), int(rng.integers(0, rgb.shape[1] - tpl.width + 1))
+    out = rgb.astype(np.float64)
+    out[y:y + tpl.height, x:x + tpl.width] = tpl.rgb + rng.normal(0.0, noise, tpl.rgb.shape)
+    return Frame(np.clip(out, 0, 255).astype(np.uint8)), (x, y)
+
+
+def check_matcher_corpus(config, frames=4, size=(806, 482), seed=0, tolerance=1e-3):
+    """Number of keys whose synthetic pastes lost a cv2 hit under a gated backend (pyramids: the peak only)."""
+    if cv2 is None:
+        logger.error("VISION: the corpus check compares against OpenCV, which is not installed")
+        return 1
+    matcher = TemplateMatcher(config)
+    backends = [b for b in VISION_BACKENDS.values() if b.gated and b.available()]
+    rng = np.random.default_rng(seed)
+    thresholds = sorted({config.CONF_LOOSE, config.CONF_NORMAL, config.CONF_READY})
+    failed = 0
+    for key, path in (config.TEMPLATES or {}).items():
+        misses = []
+        for variant in discover_template_variants(path):
+            tpl = matcher.prepare(load_template_image(variant))
+            if tpl.mask is not None or tpl.rgb is None or tpl.height > size[1] or tpl.width > size[0]:
+                continue
+            level = matcher.pyramid_level(tpl)
+            for n in range(frames):
+                base = (rng.random((size[1] // 8, size[0] // 8, 3)) * 255).astype(np.uint8)
+                rgb = np.asarray(Image.fromarray(base).resize(size, Image.BILINEAR))
+                hay = paste_template(rgb, tpl, rng, 6.0 * n)[0].haystack
+                expected = cv2.matchTemplate(hay.gray8, tpl.gray.astype(np.uint8), cv2.TM_CCOEFF_NORMED)
+                for backend in backends:
+                    matcher.backend = backend
+                    scores = matcher.score_maps(hay, [tpl])[0]
+                    for threshold in thresholds:
+                        if level:
+                            peak = np.unravel_index(int(np.argmax(expected)), expected.shape)
+                            if expected[peak] <= threshold + tolerance:
+                                continue
+                            near = scores[max(0, peak[0] - 1):peak[0] + 2, max(0, peak[1] - 1):peak[1] + 2]
+                            lost = 0 if near.max() > threshold - tolerance else 1
+                        else:
+                            lost = int(((expected > threshold + tolerance) & (scores <= threshold - tolerance)).sum())
+                        if lost:
+                            misses.append(f"{os.path.basename(variant)} frame {n} {backend.name} @{threshold:.2f}: {lost} lost")
+        if misses:
+            failed += 1
+            logger.error(f"VISION: corpus check {key}: " + "; ".join(misses))
+    logger.info(f"VISION: corpus check finished, {failed} key(s) lost cv2 hits; matcher stats {matcher.stats}")
+    return failed
+
+
+def template_pack_params(config):
+    # Derived arrays depend on these; a pack built with other values is stale.
+    return {
+        "COLOR_GATE_MIN_SHARE": config.COLOR_GATE_MIN_SHARE,
+        "COLOR_GATE_GRID_STEP": config.COLOR_GATE_GRID_STEP, "PYRAMID_MIN_AREA": config.PYRAMID_MIN_AREA,
+        "PYRAMID_MIN_SIDE": config.PYRAMID_MIN_SIDE, "PYRAMID_MAX_LEVEL": config.PYRAMID_MAX_LEVEL,
+    }
+
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def compile_template_pack(config, pack_path):
+    """Decode every template once and write grayscale, NCC and colour-gate data into one mappable file."""
+    matcher = TemplateMatcher(config)
+    blobs, entries, templates = [], {}, {}
+    size = 0
+
+    def add(arr):
+        nonlocal size
+        arr = np.ascontiguousarray(arr)
+        pad = -size % 64
+        blobs.append((pad, arr))
+        record = [size + pad, list(arr.shape), arr.dtype.str]
+        size += pad + arr.nbytes
+        return record
+
+    for key, path in (config.TEMPLATES or {}).items():
+        templates[key] = []
+        for variant in discover_template_variants(path):
+            with open(variant, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            templates[key].append([variant, digest] + file_fingerprint(variant))
+            if digest in entries:
+                continue
+            tpl = matcher.prepare(load_template_image(variant))
+            arrays = {"rgb": tpl.rgb, "gray": tpl.gray, "zero_mean": tpl.zero_mean, "colors": tpl.dominant_colors}
+            if tpl.mask is not None:
+                arrays["mask"] = tpl.mask
+            for n in range(1, matcher.pyramid_level(tpl) + 1):
+                arrays[f"level{n}"] = tpl.level(n).gray
+            entries[digest] = {"norm": tpl.norm, "arrays": {name: add(a) for name, a in arrays.items()}}
+    dirs = {d: os.stat(d).st_mtime_ns for d in {os.path.dirname(v[0]) or "." for vs in templates.values() for v in vs}}
+    header = json.dumps({
+        "version": TEMPLATE_PACK_VERSION, "params": template_pack_params(config),
+        "templates": templates, "entries": entries, "dirs": dirs,
+    }).encode("utf-8")
+    tmp = f"{pack_path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(TEMPLATE_PACK_MAGIC + struct.pack("<II", TEMPLATE_PACK_VERSION, len(header)) + header)
+        f.write(b"\0" * (-f.tell() % 64))
+        for pad, arr in blobs:
+            f.write(b"\0" * pad + arr.tobytes())
+    os.replace(tmp, pack_path)
+    logger.info(f"VISION: compiled {sum(len(v) for v in templates.values())} templates ({len(entries)} unique) into {pack_path}")
+
+
+def template_pack_stale_reason(config, header):
+    if header.get("params") != template_pack_params(config):
+        return "matcher parameters changed"
+    templates = header.get("templates", {})
+    for key, path in (config.TEMPLATES or {}).items():
+        if key not in templates or templates[key][0][0] != discover_template_variants(path)[0]:
+            return f"template list changed ({key})"
+    for directory, mtime in header.get("dirs", {}).items():
+        # A new or removed _bk variant changes the directory mtime.
+        if os.stat(directory).st_mtime_ns != mtime:
+            return f"{directory} changed"
+    for variants in templates.values():
+        for path, _, mtime, size in variants:
+            if not os.path.exists(path) or file_fingerprint(path) != [mtime, size]:
+                return f"{path} changed"
+    return None
+
+
+def load_template_pack(config, pack_path):
+    """Memory-map a compiled pack into {key: [TemplateImage]}; None if it is missing, stale or unreadable."""
+    if not os.path.exists(pack_path):
+        return None
+    try:
+        data = np.memmap(pack_path, dtype=np.uint8, mode="r")
+        if bytes(data[:8]) != TEMPLATE_PACK_MAGIC:
+            raise ValueError("not a template pack")
+        version, header_len = struct.unpack("<II", bytes(data[8:16]))
+        if version != TEMPLATE_PACK_VERSION:
+            raise ValueError(f"pack version {version}, expected {TEMPLATE_PACK_VERSION}")
+        header = json.loads(bytes(data[16:16 + header_len]).decode("utf-8"))
+        reason = template_pack_stale_reason(config, header)
+        if reason:
+            logger.warning(f"VISION: template pack is stale ({reason}); decoding PNGs. Re-run --compile-templates.")
+            return None
+        base = 16 + header_len
+        base += -base % 64
+
+        def view(record):
+            offset, shape, dtype = record
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape)) * dtype.itemsize
+            return data[base + offset:base + offset + count].view(dtype).reshape(shape)
+
+        variants = {}
+        for key in config.TEMPLATES or {}:
+            variants[key] = []
+            for path, digest, _, _ in header["templates"][key]:
+                entry = header["entries"][digest]
+                arrays = {name: view(record) for name, record in entry["arrays"].items()}
+                tpl = TemplateImage(path, arrays["rgb"], arrays["gray"], arrays["zero_mean"], entry["norm"], arrays.get("mask"))
+                tpl.dominant_colors = arrays["colors"]
+                for name, arr in arrays.items():
+                    if name.startswith("level"):
+                        tpl._levels[int(name[5:])] = TemplateImage(path, gray=arr)
+                variants[key].append(tpl)
+        return variants
+    except Exception as e:
+        logger.warning(f"VISION: could not map template pack {pack_path}: {e}")
+        return None
+
+
+class TemplateRescaler:
+    """Template sets rescaled to the current window size, kept in a bounded LRU and optionally on disk."""
+
+    def __init__(self, matcher, variants, reference=None, capacity=4, tolerance=0.02, cache_dir=None):
+        self.matcher = matcher
+        self.variants = variants
+        self.reference = tuple(reference) if reference else None
+        self.capacity = capacity
+        self.tolerance = tolerance
+        self.cache_dir = cache_dir
+        self._cache = OrderedDict()
+
+    def variants_for(self, width, height):
+        if self.reference is None:
+            # Only for this session: a window that was the wrong size at startup must not become the next run's reference.
+            self.reference = (width, height)
+            logger.info(f"VISION: template reference size taken as {width}x{height} for this session")
+        sx, sy = width / self.reference[0], height / self.reference[1]
+        if abs(sx - 1.0) <= self.tolerance and abs(sy - 1.0) <= self.tolerance:
+            return self.variants
+        size = (width, height)
+        if size in self._cache:
+            self._cache.move_to_end(size)
+            return self._cache[size]
+        scaled = self._load(size) or self._rescale(size, sx, sy)
+        self._cache[size] = scaled
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return scaled
+
+    def _rescale(self, size, sx, sy):
+        start = time.perf_counter()
+        scaled = {}
+        for key, tpls in self.variants.items():
+            scaled[key] = []
+            for t in tpls:
+                dims = (max(1, round(t.width * sx)), max(1, round(t.height * sy)))
+                rgb = np.asarray(t.image.resize(dims, Image.BILINEAR))
+                mask = None if t.mask is None else np.asarray(Image.fromarray(t.mask).resize(dims, Image.NEAREST))
+                scaled[key].append(self.matcher.prepare(TemplateImage(t.path, rgb, mask=mask)))
+        logger.info(
+            f"VISION: rescaled templates for {size[0]}x{size[1]} (x{sx:.3f}, y{sy:.3f}) "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+        self._save(size, scaled)
+        return scaled
+
+    def _fingerprint(self):
+        parts = [list(self.reference)] + [[k, t.path, t.width, t.height] for k, ts in sorted(self.variants.items()) for t in ts]
+        return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def _disk_path(self, size):
+        return os.path.join(self.cache_dir, f"templates_{size[0]}x{size[1]}.npz")
+
+    def _save(self, size, scaled):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            arrays = {f"{k}|{i}": t.rgb for k, ts in scaled.items() for i, t in enumerate(ts)}
+            arrays.update({f"{k}|{i}|mask": t.mask for k, ts in scaled.items() for i, t in enumerate(ts) if t.mask is not None})
+            np.savez(self._disk_path(size), __fingerprint__=np.array(self._fingerprint()), **arrays)
+        except Exception as e:
+            logger.warning(f"VISION: could not persist rescaled templates: {e}")
+
+    def _load(self, size):
+        if not self.cache_dir or not os.path.exists(self._disk_path(size)):
+            return None
+        try:
+            with np.load(self._disk_path(size)) as data:
+                if str(data["__fingerprint__"]) != self._fingerprint():
+                    return None
+                scaled = {
+                    k: [
+                        self.matcher.prepare(TemplateImage(t.path, data[f"{k}|{i}"], mask=data[f"{k}|{i}|mask"] if f"{k}|{i}|mask" in data else None))
+                        for i, t in enumerate(ts)
+                    ]
+                    for k, ts in self.variants.items()
+                }
+            logger.info(f"VISION: loaded rescaled templates for {size[0]}x{size[1]} from {self.cache_dir}")
+            return scaled
+        except Exception as e:
+            logger.warning(f"VISION: ignoring rescale cache for {size[0]}x{size[1]}: {e}")
+            return None
+
+
+def load_vision_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"VISION: ignoring unreadable state file {path}: {e}")
+        return {}
+
+
+def save_vision_state(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+class SearchPriors:
+    """Learned per-template match bands, stored as window ratios so they survive resizes."""
+
+    def __init__(self, data=None, min_samples=3, margin=0.05):
+        self.min_samples = min_samples
+        self.margin = margin
+        # key -> [min_cx, max_cx, min_cy, max_cy, samples], centres as ratios of the window.
+        self.bands = {k: list(v) for k, v in (data or {}).items() if isinstance(v, list) and len(v) == 5}
+
+    def observe(self, key, cx_ratio, cy_ratio):
+        band = self.bands.get(key)
+        if band is None:
+            self.bands[key] = [cx_ratio, cx_ratio, cy_ratio, cy_ratio, 1]
+            return
+        band[0], band[1] = min(band[0], cx_ratio), max(band[1], cx_ratio)
+        band[2], band[3] = min(band[2], cy_ratio), max(band[3], cy_ratio)
+        band[4] += 1
+
+    def region(self, key, tw, th, width, height):
+        """Top-left search window (x0, y0, x1, y1) for a tw x th template, or None if not learned yet."""
+        band = self.bands.get(key)
+        if band is None or band[4] < self.min_samples:
+            return None
+        x0 = max(0, int((band[0] - self.margin) * width - tw / 2))
+        x1 = min(width - tw + 1, int((band[1] + self.margin) * width - tw / 2) + 1)
+        y0 = max(0, int((band[2] - self.margin) * height - th / 2))
+        y1 = min(height - th + 1, int((band[3] + self.margin) * height - th / 2) + 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    def to_dict(self):
+        return {k: list(v) for k, v in self.bands.items()}
+
+
+class VariantStats:
+    """Per-variant hit counters; lookups try the most recently successful variant, then the most frequent."""
+
+    def __init__(self, data=None):
+        # {key: {variant file name: [hits, unix time of last hit]}}
+        self.counts = {k: {name: list(v) for name, v in names.items()} for k, names in (data or {}).items()}
+
+    def hit(self, key, tpl):
+        entry = self.counts.setdefault(key, {}).setdefault(os.path.basename(tpl.path), [0, 0.0])
+        entry[0] += 1
+        entry[1] = time.time()
+
+    def order(self, key, tpls):
+        counts = self.counts.get(key)
+        if not counts:
+            return list(range(len(tpls)))
+        stats = [counts.get(os.path.basename(t.path), [0, 0.0]) for t in tpls]
+        ranked = sorted(range(len(tpls)), key=lambda i: -stats[i][0])
+        recent = max(ranked, key=lambda i: stats[i][1])
+        if stats[recent][1]:
+            ranked.remove(recent)
+            ranked.insert(0, recent)
+        return ranked
+
+    def dead(self, variants, min_hits):
+        """(key, file name) of variants that never matched while their key matched at least min_hits times."""
+        out = []
+        for key, tpls in variants.items():
+            counts = self.counts.get(key, {})
+            if sum(c[0] for c in counts.values()) < min_hits:
+                continue
+            out += [(key, os.path.basename(t.path)) for t in tpls if counts.get(os.path.basename(t.path), [0])[0] == 0]
+        return out
+
+    def to_dict(self):
+        return self.counts
+
+
+@dataclass
+class MatchResult:
+    """Outcome of one lookup: the best score (None on screen, 0.0 below CONF_LOOSE) and location seen for key."""
+    key: str
+    found: bool
+    score: Optional[float]
+    box: Optional[Any]
+    confidence: float
+
+    def __bool__(self):
+        return self.found
+
+
+class VariantHarvester:
+    """Stages near-miss crops as candidate _bk variants once the same key is found at the same spot."""
+
+    def __init__(self, matcher, config):
+        self.matcher = matcher
+        self.config = config
+        self.pending = {}
+        self.staged = None
+        self.saved = 0
+        self.duplicates = 0
+
+    def near_miss(self, key, confidence, analysis, state):
+        best = analysis.best(key)
+        if best is None or best[3] < confidence - self.config.NEAR_MISS_MARGIN:
+            return
+        t, x, y, score = best
+        crop = np.asarray(analysis.image)[y:y + t.height, x:x + t.width].copy()
+        self.pending[key] = {"crop": crop, "x": x, "y": y, "score": score, "confidence": confidence,
+                             "state": state, "time": time.time(), "path": t.path}
+
+    def confirm_hit(self, key, x, y, variants):
+        entry = self._live(key)
+        if entry is not None and abs(x - entry["x"]) <= entry["crop"].shape[1] // 2 and abs(y - entry["y"]) <= entry["crop"].shape[0] // 2:
+            self._stage(key, self.pending.pop(key), "found", variants)
+
+    def _live(self, key):
+        entry = self.pending.get(key)
+        if entry is not None and time.time() - entry["time"] > self.config.NEAR_MISS_CONFIRM_WINDOW:
+            del self.pending[key]
+            return None
+        return entry
+
+    def _load_staged(self):
+        self.staged = {}
+        directory = self.config.NEAR_MISS_DIR
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            try:
+                with Image.open(os.path.join(directory, name)) as image:
+                    key = image.text.get("key")
+                    tpl = TemplateImage(name, np.asarray(image.convert("RGB")))
+                if key:
+                    self.staged.setdefault(key, []).append(tpl)
+            except Exception:
+                continue
+
+    def is_duplicate(self, candidate, references):
+        for ref in references:
+            small, large = (candidate, ref) if candidate.height * candidate.width <= ref.height * ref.width else (ref, candidate)
+            if small.height > large.height or small.width > large.width:
+                continue
+            hay = HaystackImage(large.gray)
+            if self.matcher.dense_scores(hay, small, cache=False).max() >= self.config.NEAR_MISS_DUPLICATE_SCORE:
+                return True
+        return False
+
+    def _stage(self, key, entry, reason, variants):
+        if self.staged is None:
+            self._load_staged()
+        candidate = TemplateImage(entry["path"], entry["crop"])
+        staged = self.staged.setdefault(key, [])
+        if self.is_duplicate(candidate, list(variants.get(key, [])) + staged):
+            self.duplicates += 1
+            return
+        if len(staged) >= self.config.NEAR_MISS_MAX_PER_KEY:
+            return
+        root = os.path.splitext(os.path.basename(entry["path"]))[0].replace("_masked", "")
+        name = f"{root}_bk_candidate_{time.strftime('%Y%m%d_%H%M%S')}_{len(staged)}.png"
+        info = PngImagePlugin.PngInfo()
+        for field_name, value in (("key", key), ("score", f"{entry['score']:.4f}"), ("confidence", f"{entry['confidence']:.2f}"),
+                                  ("state", entry["state"]), ("confirmed_by", reason)):
+            info.add_text(field_name, value)
+        try:
+            os.makedirs(self.config.NEAR_MISS_DIR, exist_ok=True)
+            Image.fromarray(entry["crop"]).save(os.path.join(self.config.NEAR_MISS_DIR, name), pnginfo=info)
+        except Exception as e:
+            logger.warning(f"VISION: could not stage near-miss variant for {key}: {e}")
+            return
+        staged.append(candidate)
+        self.saved += 1
+        logger.info(f"VISION: staged {name} ({key} scored {entry['score']:.3f} < {entry['confidence']:.2f}, confirmed by {reason})")
+
+
+def sparse_hits(scores, floor, x0=0, y0=0):
+    """(xs, ys, scores) of every position in a score map above floor, offset by the map's origin."""
+    if scores is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    idx = np.flatnonzero(scores > floor)
+    ys, xs = np.unravel_index(idx, scores.shape)
+    return xs + x0, ys + y0, scores.ravel()[idx]
+
+
+class FrameAnalysis:
+    """Hit tables for one snapshot; the batched pass scores each key's best-ranked variant, lookups the rest."""
+
+    def __init__(self, matcher, image, variants, floor, priors=None, confidence_for=None, stats=None,
+                 previous=None, tile=None, max_dirty_share=0.5, order_for=None, pool=None):
+        self.matcher = matcher
+        self.pool = pool
+        self.image = image
+        self.variants = variants
+        self.floor = floor
+        self.priors = priors
+        self.confidence_for = confidence_for
+        self.stats = stats if stats is not None else {}
+        self.hits = {}
+        # Keys whose table only covers their learned band, not the full window.
+        self.partial = set()
+        # Top-left search window each key's table covers, so a carried-over table can be patched in place.
+        self.rois = {}
+        self.tile = tile
+        self.tiles = self.matcher.haystack(image).tile_hashes(tile) if tile else None
+        self.dirty = None
+        self.previous = None
+        self.max_dirty_share = max_dirty_share
+        self.order_for = order_for
+        if previous is not None and previous.tiles is not None and self.tiles is not None \
+                and previous.tiles.shape == self.tiles.shape and previous.variants is variants:
+            self.dirty = previous.tiles != self.tiles
+            self.previous = previous
+            previous.previous = None
+
+    def analyze(self, keys, banded=True):
+        """Tables for keys; banded tries each key's learned band first, the batched pass goes straight to full windows."""
+        pending = [k for k in dict.fromkeys(keys) if k not in self.hits and k in self.variants]
+        pending = [k for k in pending if not self._reuse(k)]
+        if banded:
+            pending = [k for k in pending if not self._analyze_band(k)]
+        self._analyze_full(pending, lead=True)
+
+    def ranked(self, key):
+        """Variant indices in the order lookups try them."""
+        tpls = self.variants.get(key, [])
+        return list(self.order_for(key, tpls)) if self.order_for and tpls else list(range(len(tpls)))
+
+    def _reuse(self, key):
+        """Carry the previous frame's table over for key, re-scoring only around changed tiles."""
+        prev = self.previous
+        if prev is None or key not in prev.hits:
+            return False
+        if not self.dirty.any():
+            self.hits[key], self.rois[key] = list(prev.hits[key]), list(prev.rois[key])
+            if key in prev.partial:
+                self.partial.add(key)
+            self.stats["tile_reused"] = self.stats.get("tile_reused", 0) + 1
+            return True
+        rows, cols = np.nonzero(self.dirty)
+        dx0, dy0 = int(cols.min()) * self.tile, int(rows.min()) * self.tile
+        dx1, dy1 = (int(cols.max()) + 1) * self.tile, (int(rows.max()) + 1) * self.tile
+        if (dx1 - dx0) * (dy1 - dy0) > self.max_dirty_share * self.dirty.size * self.tile * self.tile:
+            return False
+        hay = self.matcher.haystack(self.image)
+        hits, rois = [], []
+        for t, table, roi in zip(self.variants[key], prev.hits[key], prev.rois[key]):
+            if table is None:
+                hits.append(None)
+                rois.append(None)
+                continue
+            xs, ys, scores = table
+            # Top-left positions whose window touches the changed block, clipped to the covered window.
+            box = (max(roi[0], dx0 - t.width + 1), max(roi[1], dy0 - t.height + 1), min(roi[2], dx1), min(roi[3], dy1))
+            keep = ~((xs >= box[0]) & (xs < box[2]) & (ys >= box[1]) & (ys < box[3]))
+            fresh = self._sparse(self.matcher.score_region(hay, t, box) if box[2] > box[0] and box[3] > box[1] else None, box[0], box[1])
+            merged = [np.concatenate([old[keep], new]) for old, new in zip((xs, ys, scores), fresh)]
+            order = np.lexsort((merged[0], merged[1]))
+            hits.append(tuple(a[order] for a in merged))
+            rois.append(roi)
+        self.hits[key], self.rois[key] = hits, rois
+        if key in prev.partial:
+            self.partial.add(key)
+        self.stats["tile_rescored"] = self.stats.get("tile_rescored", 0) + 1
+        return True
+
+    def _analyze_full(self, keys, lead=False):
+        """Full-window tables for keys: only the best-ranked unscored variant if lead, else every variant."""
+        jobs = []
+        for k in keys:
+            if k in self.partial or k not in self.hits:
+                self.hits[k], self.rois[k] = [None] * len(self.variants[k]), [None] * len(self.variants[k])
+                self.partial.discard(k)
+            todo = [i for i in self.ranked(k) if self.hits[k][i] is None]
+            jobs += [(k, i) for i in todo[:1 if lead else None]]
+        self._score(jobs)
+
+    def _score(self, jobs):
+        if not jobs:
+            return
+        tpls = [self.variants[k][i] for k, i in jobs]
+        tables = self.pool.score(self.image, self.variants, jobs, self.floor, self.stats) if self.pool is not None else None
+        if tables is None:
+            tables = [self._sparse(scores) for scores in self.matcher.score_maps(self.matcher.haystack(self.image), tpls)]
+        for (k, i), t, table in zip(jobs, tpls, tables):
+            self.hits[k][i] = table
+            self.rois[k][i] = (0, 0, self.image.width - t.width + 1, self.image.height - t.height + 1)
+
+    def _analyze_band(self, key):
+        if self.priors is None or self.confidence_for is None:
+            return False
+        hay = self.matcher.haystack(self.image)
+        hits, rois, best = [], [], -1.0
+        for t in self.variants[key]:
+            roi = self.priors.region(key, t.width, t.height, hay.width, hay.height)
+            if roi is None:
+                return False
+            scores = self.matcher.score_region(hay, t, roi)
+            hits.append(self._sparse(scores, roi[0], roi[1]))
+            rois.append(roi)
+            if scores is not None and scores.size:
+                best = max(best, float(scores.max()))
+        if best <= self.confidence_for(key):
+            self.stats["prior_fallback"] = self.stats.get("prior_fallback", 0) + 1
+            return False
+        self.stats["prior_band"] = self.stats.get("prior_band", 0) + 1
+        self.hits[key], self.rois[key] = hits, rois
+        self.partial.add(key)
+        return True
+
+    def _sparse(self, scores, x0=0, y0=0):
+        return sparse_hits(scores, self.floor, x0, y0)
+
+    def matches(self, key, confidence, exhaustive=False):
+        """Yield (template, x, y, score) above confidence, variant by variant, in raster order."""
+        if confidence < self.floor:
+            for n in self.ranked(key):
+                t = self.variants[key][n]
+                for x, y, score in self.matcher.locate_all(t, self.image, confidence):
+                    yield t, x, y, score
+            return
+        if key not in self.variants:
+            return
+        self.analyze([key])
+        if key in self.partial and (exhaustive or not any((s > confidence).any() for _, _, s in self.hits[key])):
+            self._analyze_full([key], lead=not exhaustive)
+        for n in self.ranked(key):
+            if self.hits[key][n] is None:
+                self._score([(key, n)])
+            t, (xs, ys, scores) = self.variants[key][n], self.hits[key][n]
+            for i in np.flatnonzero(scores > confidence):
+                yield t, int(xs[i]), int(ys[i]), float(scores[i])
+
+    def best(self, key):
+        """Highest-scoring (template, x, y, score) over the variants scored so far, or None."""
+        best = None
+        for t, table in zip(self.variants.get(key, []), self.hits.get(key, [])):
+            if table is not None and len(table[2]):
+                i = int(np.argmax(table[2]))
+                if best is None or table[2][i] > best[3]:
+                    best = (t, int(table[0][i]), int(table[1][i]), float(table[2][i]))
+        return best
+
+    def detections(self, key, confidence):
+        """Every variant's hits as one (N, 4) box array and (N,) scores, for NMS."""
+        if confidence < self.floor:
+            rows = [(x, y, t.width, t.height, score) for t, x, y, score in self.matches(key, confidence)]
+            arr = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+            return arr[:, :4].astype(np.int64), arr[:, 4]
+        if key not in self.variants:
+            return np.empty((0, 4), dtype=np.int64), np.empty(0)
+        self.analyze([key])
+        if key in self.partial or any(table is None for table in self.hits[key]):
+            self._analyze_full([key])
+        boxes, scores = [], []
+        for t, (xs, ys, s) in zip(self.variants.get(key, []), self.hits.get(key, [])):
+            sel = s > confidence
+            n = int(sel.sum())
+            boxes.append(np.column_stack([xs[sel], ys[sel], np.full(n, t.width), np.full(n, t.height)]))
+            scores.append(s[sel])
+        if not boxes:
+            return np.empty((0, 4), dtype=np.int64), np.empty(0)
+        return np.concatenate(boxes).astype(np.int64), np.concatenate(scores)
+
+
+def shard_jobs(costs, shards):
+    """Split job indices into at most `shards` lists of similar total cost, costliest jobs placed first."""
+    out, load = [[] for _ in range(shards)], [0] * shards
+    for n in sorted(range(len(costs)), key=lambda n: -costs[n]):
+        w = load.index(min(load))
+        out[w].append(n)
+        load[w] += costs[n]
+    return [shard for shard in out if shard]
+
+
+# Per-process state of a match worker, set up once by _match_worker_init.
+_match_worker: Dict[str, Any] = {}
+
+
+def _match_worker_init(config, variants, shm_name):
+    matcher = TemplateMatcher(config)
+    _match_worker.update(
+        matcher=matcher, shm=shared_memory.SharedMemory(name=shm_name), seq=None, hay=None,
+        rescaler=TemplateRescaler(matcher, variants, capacity=config.RESCALE_CACHE_SIZE,
+                                  tolerance=config.RESCALE_TOLERANCE, cache_dir=config.RESCALE_CACHE_DIR),
+    )
+
+
+def _match_worker_score(seq, shape, reference, backend, jobs, floor):
+    """Score (key, variant) jobs against the frame in shared memory; returns sparse hits and stat counts."""
+    w = _match_worker
+    if w["seq"] != seq:
+        # Copied out so the parent can publish the next frame while colour/tile views are still cached here.
+        rgb = np.ndarray(shape, dtype=np.uint8, buffer=w["shm"].buf).copy()
+        w["hay"], w["seq"] = Frame(rgb).haystack, seq
+    rescaler, matcher = w["rescaler"], w["matcher"]
+    if rescaler.reference != tuple(reference):
+        rescaler.reference = tuple(reference)
+        rescaler._cache.clear()
+    variants = rescaler.variants_for(shape[1], shape[0])
+    matcher.backend = VISION_BACKENDS[backend]
+    matcher.stats.clear()
+    maps = matcher.score_maps(w["hay"], [variants[k][i] for k, i in jobs])
+    return [sparse_hits(scores, floor) for scores in maps], dict(matcher.stats)
+
+
+class MatchWorkerPool:
+    """Worker processes sharing the batched per-frame pass through a shared-memory frame; failures fall back in-process."""
+
+    def __init__(self, config, rescaler, workers):
+        self.config = config
+        self.rescaler = rescaler
+        self.workers = workers
+        self.executor = None
+        self.shm = None
+        self.seq = 0
+        self._published = None
+        self.failed = False
+        atexit.register(self.close)
+
+    def _start(self, nbytes):
+        self.close()
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=get_context("fork"), initializer=_match_worker_init,
+            initargs=(self.config, self.rescaler.variants, self.shm.name),
+        )
+        logger.info(f"VISION: started {self.workers} match worker(s) over a {nbytes >> 10} KiB shared frame")
+
+    def _publish(self, image):
+        rgb = np.asarray(image)
+        if self.shm is None or self.shm.size < rgb.nbytes:
+            self._start(rgb.nbytes)
+        np.ndarray(rgb.shape, dtype=np.uint8, buffer=self.shm.buf)[...] = rgb
+        self.seq += 1
+        self._published = image
+        return rgb.shape
+
+    def describe(self):
+        return "in-process" if self.failed else f"{self.workers} worker process(es)"
+
+    def score(self, image, variants, jobs, floor, stats=None):
+        """Sparse hit tables for (key, variant) jobs in job order, or None to score them in-process."""
+        # A single lookup is cheaper in-process than the round trip to the workers.
+        if self.failed or len(jobs) < 2:
+            return None
+        shards = shard_jobs([variants[k][i].gray.size for k, i in jobs], self.workers)
+        try:
+            shape = self._publish(image) if image is not self._published else (image.height, image.width, 3)
+            futures = [
+                (shard, self.executor.submit(
+                    _match_worker_score, self.seq, shape, self.rescaler.reference, self.rescaler.matcher.backend.name,
+                    [jobs[n] for n in shard], floor))
+                for shard in shards
+            ]
+            tables = [None] * len(jobs)
+            for shard, future in futures:
+                results, counts = future.result()
+                for n, table in zip(shard, results):
+                    tables[n] = table
+                if stats is not None:
+                    for name, count in counts.items():
+                        stats[name] = stats.get(name, 0) + count
+            return tables
+        except Exception as exc:
+            logger.warning(f"VISION: match workers failed ({exc!r}); falling back to in-process matching")
+            self.failed = True
+            self.close()
+            return None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        self._published = None
+
+
+class MatchThreadPool:
+    """Threads sharing the batched per-frame pass, split by variant and, for large templates, by row band."""
+
+    def __init__(self, matcher, threads, band_min_area):
+        self.matcher = matcher
+        self.workers = threads
+        self.band_min_area = band_min_area
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="match")
+        self.failed = False
+        atexit.register(self.close)
+
+    def describe(self):
+        return f"{self.workers} thread(s)"
+
+    def score(self, image, variants, jobs, floor, stats=None):
+        """Sparse hit tables for (key, variant) jobs in job order, or None if splitting would not help."""
+        hay = self.matcher.haystack(image)
+        tpls = [variants[k][i] for k, i in jobs]
+        bands, whole = {}, []
+        per_job = self.workers // len(jobs)
+        for n, t in enumerate(tpls):
+            rows = hay.height - t.height + 1
+            # Pyramid templates only refine around coarse peaks, which a band cannot do on its own.
+            if per_job > 1 and t.gray.size >= self.band_min_area and rows >= 2 * per_job and not self.matcher.pyramid_level(t):
+                step = -(-rows // per_job)
+                bands[n] = [(y, min(rows, y + step)) for y in range(0, rows, step)]
+            else:
+                whole.append(n)
+        shards = shard_jobs([tpls[n].gray.size for n in whole], self.workers)
+        if len(shards) + sum(len(b) for b in bands.values()) < 2:
+            return None
+        futures = [
+            ([whole[m] for m in shard], self.executor.submit(
+                self.matcher.score_maps, hay, [tpls[whole[m]] for m in shard]))
+            for shard in shards
+        ]
+        banded = {
+            n: [self.executor.submit(self._score_band, hay, tpls[n], y0, y1, floor) for y0, y1 in rows]
+            for n, rows in bands.items()
+        }
+        tables = [None] * len(jobs)
+        for shard, future in futures:
+            for n, scores in zip(shard, future.result()):
+                tables[n] = sparse_hits(scores, floor)
+        for n, parts in banded.items():
+            parts = [f.result() for f in parts]
+            tables[n] = tuple(np.concatenate(column) for column in zip(*parts))
+        return tables
+
+    def _score_band(self, hay, tpl, y0, y1, floor):
+        return sparse_hits(self.matcher.score_region(hay, tpl, (0, y0, hay.width - tpl.width + 1, y1)), floor, 0, y0)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class SettleDetector:
+    """Waits until consecutive thumbnails stop changing instead of sleeping a fixed animation time."""
+
+    def __init__(self, config):
+        self.config = config
+        # reason -> [waits, seconds saved]
+        self.saved = {}
+
+    def wait(self, capture, reason, max_wait, roi=None, threshold=None):
+        """Last frame captured once settled (or at max_wait); None, after the full max_wait, if a capture fails."""
+        threshold = self.config.SETTLE_MOTION_THRESHOLD if threshold is None else threshold
+        side = self.config.SETTLE_THUMBNAIL
+        start = time.time()
+        # Give the click's animation a moment to start, so an untouched screen is not taken as settled.
+        time.sleep(min(self.config.SETTLE_MIN_WAIT, max_wait))
+        frame, still = capture(), 0
+        while frame is not None and still < self.config.SETTLE_STILL_FRAMES:
+            remaining = max_wait - (time.time() - start)
+            if remaining <= 0:
+                break
+            time.sleep(min(self.config.SETTLE_POLL, remaining))
+            current = capture()
+            if current is None:
+                # Settling can no longer be confirmed, so fall back to the fixed wait.
+                frame = None
+                break
+            motion = float(np.abs(current.thumbnail(side, roi) - frame.thumbnail(side, roi)).mean())
+            still = still + 1 if motion <= threshold else 0
+            frame = current
+        waited = time.time() - start
+        if frame is None:
+            time.sleep(max(0.0, max_wait - waited))
+            waited = max_wait
+        entry = self.saved.setdefault(reason, [0, 0.0])
+        entry[0] += 1
+        entry[1] += max(0.0, max_wait - waited)
+        return frame
+
+
+class FreezeDetector:
+    """Notices a window whose thumbnail has not changed for a while, e.g. a game hung mid-quest."""
+
+    def __init__(self, config):
+        self.config = config
+        self.state = None
+        self.anchor = None
+        self.still_since = None
+
+    def update(self, frame, state, timeout):
+        """True once frame has been still for timeout seconds in state; timeout None means state is not watched."""
+        current = frame.thumbnail(self.config.SETTLE_THUMBNAIL)
+        if timeout is None or state != self.state or self.anchor is None \
+                or float(np.abs(current - self.anchor).mean()) > self.config.FREEZE_MOTION_THRESHOLD:
+            self.state, self.anchor, self.still_since = state, current, frame.captured_at
+            return False
+        return frame.captured_at - self.still_since >= timeout
+
+    def reset(self):
+        self.state = self.anchor = self.still_since = None
+
+
+class ScreenshotCounter:
+    """Counts pyscreeze screenshots (behind pyautogui.screenshot and locate*OnScreen); vision should only use mss."""
+
+    def __init__(self, screenshot):
+        self.screenshot = screenshot
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return self.screenshot(*args, **kwargs)
+
+
+# Installed once per process, so bots created later never wrap an already counted screenshot.
+screenshot_counter = ScreenshotCounter(pyscreeze.screenshot)
+pyscreeze.screenshot = pyautogui.screenshot = screenshot_counter
+
+
 class GameWindowNotFoundError(Exception): pass
 
 class BBSBot:
@@ -304,6 +2046,28 @@ class BBSBot:
         ("MENU", "open_coop_quest"), ("MENU", "coop_quest"), ("MENU", "coop_1"), ("MENU", "coop_2"),
         ("GAME_STARTUP", "game_start"),
     ]
+    # Templates every popup sweep queries unconditionally; follow-up keys are matched lazily.
+    POPUP_KEYS = [
+        "download_data_title", "update_return_title", "login_failed_title", "brave_bonus_title",
+        "player_rank_reward_title", "network_title_error", "closed_room_coop_quest_menu",
+        "close_news", "okay", "close",
+    ]
+    # Everything a state's handler polls each tick, including run_started() and the modal checks it calls.
+    RUN_START_KEYS = ["ingame_auto_on", "ingame_auto_off"]
+    STATE_TEMPLATE_KEYS = {
+        "MENU": ["open_coop_quest", "coop_quest", "coop_1", "coop_2", "enter_room_button"],
+        "ENTER_ROOM_LIST": ["enter_room_button", "auto", "search_again", "ready"],
+        "SCAN_ROOMS": ["ready", "search_again", "auto", "room_rules_valid", "room_not_met"],
+        "JOIN_PENDING": ["ready"] + RUN_START_KEYS + [
+            "closed_room_coop_quest_menu", "unavailable_close", "room_not_met", "auto", "search_again",
+        ],
+        "READY": ["ready"] + RUN_START_KEYS + ["retire"],
+        "CHECK_RUN_START": ["ready"] + RUN_START_KEYS + ["retire"],
+        "RUNNING": ["game_start", "tap1"],
+        "FINISH": ["tap1", "tap2", "retry"],
+        "GAME_STARTUP": ["game_start", "coop_1", "coop_2", "coop_quest", "open_coop_quest"],
+        "RECOVERY": ["closed_room_coop_quest_menu"] + [t for _, t in RECOVERY_MAP],
+    }
 
     def __init__(self, config=None):
         self.config = config or BotConfiguration()
@@ -321,6 +2085,14 @@ class BBSBot:
         self._last_room_signature = None
         self._last_join_row = None
         self.fatigue_modifier, self._last_popup_check = 1.0, 0.0
+        # key -> (present when last checked, time last present)
+        self._presence = {}
+        self.frame_ring = FrameRing(self.config.FRAME_RING_SIZE)
+        # find_stable_image outcomes: confirmed from frames already captured / extra captures it needed.
+        self.stability_from_ring = self.stability_captures = 0
+        self.settle = SettleDetector(self.config)
+        self.freeze = FreezeDetector(self.config)
+        self.freeze_recoveries = 0
         self._last_id_search = 0.0
         self._last_non_game_focus = None
         self._last_non_game_focus_at = 0.0
@@ -343,7 +2115,45 @@ class BBSBot:
         }
         self.cached_templates = {}
         self.template_variants = {}
+        self.matcher = TemplateMatcher(self.config)
+        self.analysis = None
+        self._lookup_analysis = None
+        self.tile_stats = {}
+        self.vision_state = load_vision_state(self.config.VISION_STATE_PATH)
+        self.priors = SearchPriors(self.vision_state.get("priors"), self.config.PRIOR_MIN_SAMPLES, self.config.PRIOR_MARGIN_RATIO)
+        self.variant_stats = VariantStats(self.vision_state.get("variants"))
+        self.harvester = VariantHarvester(self.matcher, self.config)
+        self.vision_stats = self.matcher.stats
+        self._last_vision_state_save = time.time()
+        self.frame_token = 0
+        self.mss_captures = 0
+        self._screenshot_calls_at_start = screenshot_counter.calls
+        self._find_cache = {}
+        self.find_cache_hits = self.find_cache_misses = 0
         self._load_templates()
+        self.rescaler = TemplateRescaler(
+            self.matcher, self.template_variants,
+            reference=self.config.TEMPLATE_REFERENCE_SIZE,
+            capacity=self.config.RESCALE_CACHE_SIZE, tolerance=self.config.RESCALE_TOLERANCE,
+            cache_dir=self.config.RESCALE_CACHE_DIR,
+        )
+        self.match_pool = None
+        if self.config.MATCH_WORKERS > 0:
+            self.match_pool = MatchWorkerPool(self.config, self.rescaler, self.config.MATCH_WORKERS)
+        elif self.config.MATCH_THREADS > 1:
+            self.match_pool = MatchThreadPool(self.matcher, self.config.MATCH_THREADS, self.config.MATCH_BAND_MIN_AREA)
+        # Wall time of each frame's batched match pass: [frames, total seconds, worst seconds].
+        self.frame_match_time = [0, 0.0, 0.0]
+        self.backend_auto = self.config.VISION_BACKEND == "auto"
+        self._backend_calibrated = False
+        if not self.backend_auto:
+            backend = VISION_BACKENDS.get(self.config.VISION_BACKEND)
+            if backend is not None and backend.available():
+                self.matcher.backend = backend
+                logger.info(f"VISION: using the {backend.name} backend (pinned)")
+            else:
+                logger.warning(f"VISION: backend {self.config.VISION_BACKEND} is not available; calibrating instead")
+                self.backend_auto = True
         self.check_dependencies()
         try:
             self.disp = display.Display()
@@ -372,14 +2182,16 @@ class BBSBot:
 
     def _load_templates(self):
         if not self.config.TEMPLATES: return
+        packed = load_template_pack(self.config, self.config.TEMPLATE_PACK_PATH)
+        if packed is not None:
+            self.template_variants.update(packed)
+            self.cached_templates.update({k: v[0] for k, v in packed.items()})
+            logger.info(f"VISION: mapped {sum(len(v) for v in packed.values())} templates from {self.config.TEMPLATE_PACK_PATH}")
+            return
         for k, v in self.config.TEMPLATES.items():
             try:
-                self.cached_templates[k] = Image.open(v).convert("RGB")
-                variants = [(v, self.cached_templates[k])]
-                root, ext = os.path.splitext(v)
-                for alt in sorted(fnmatch.filter(os.listdir(os.path.dirname(v) or "."), os.path.basename(root) + "_bk*" + ext)):
-                    alt_path = os.path.join(os.path.dirname(v), alt)
-                    variants.append((alt_path, Image.open(alt_path).convert("RGB")))
+                variants = [self.matcher.prepare(load_template_image(path)) for path in discover_template_variants(v)]
+                self.cached_templates[k] = variants[0]
                 self.template_variants[k] = variants
             except Exception: logger.error(f"Template error: {k}")
 
@@ -449,8 +2261,8 @@ class BBSBot:
                 try:
                     region = self.get_game_region()
                     monitor = {"top": region[1], "left": region[0], "width": region[2], "height": region[3]}
-                    sct_img = self.sct.grab(monitor)
-                    self.snapshot = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+                    self.mss_captures += 1
+                    self.set_snapshot(Frame.from_grab(self.sct.grab(monitor)))
                 except Exception as e:
                     screenshot_status = f"missing:{type(e).__name__}"
             if self.snapshot:
@@ -483,44 +2295,209 @@ class BBSBot:
     def find_image(self, key, confidence=None, region=None, haystack=None):
         conf = confidence or self.get_template_confidence(key)
         if not self.region: return None
+        # Without a frame to search, take a fresh mss capture rather than a pyscreeze screenshot.
+        if haystack is None: haystack = self.capture_for_lookup()
+        if haystack is None: return None
+        if haystack is not self.snapshot:
+            return self._find_image_uncached(key, conf, region, haystack)
+        cache_key = (self.frame_token, key, conf, region)
+        if cache_key in self._find_cache:
+            self.find_cache_hits += 1
+            return self._find_cache[cache_key]
+        self.find_cache_misses += 1
+        res = self._find_cache[cache_key] = self._find_image_uncached(key, conf, region, haystack)
+        return res
+
+    def _find_image_uncached(self, key, conf, region, haystack):
         try:
-            if haystack:
-                for _, t in self.template_variants.get(key, []):
-                    try:
-                        res = pyautogui.locate(t, haystack, confidence=conf)
-                    except Exception:
-                        res = None
-                    if res:
-                        return pyscreeze.Box(res.left + self.region[0], res.top + self.region[1], res.width, res.height)
-                return None
-            template_path = self.config.TEMPLATES.get(key, "")
-            if not template_path: return None
-            return pyautogui.locateOnScreen(template_path, region=self.region, confidence=conf)
+            analysis = self.frame_analysis(haystack)
+            for t, x, y, score in analysis.matches(key, conf):
+                width, height = haystack.size
+                # Loose lookups (CONF_LOOSE, exit thresholds) must not widen the band a strict lookup searches.
+                if score > self.get_template_confidence(key):
+                    self.priors.observe(key, (x + t.width / 2) / width, (y + t.height / 2) / height)
+                self.variant_stats.hit(key, t)
+                if self.config.NEAR_MISS_HARVEST:
+                    self.harvester.confirm_hit(key, x, y, analysis.variants)
+                return pyscreeze.Box(x + self.region[0], y + self.region[1], t.width, t.height)
+            if self.config.NEAR_MISS_HARVEST:
+                self.harvester.near_miss(key, conf, analysis, self.state)
+            return None
         except Exception: return None
 
-    def find_stable_image(self, key, confidence=None, frames=3):
-        for _ in range(frames):
-            res = self.find_image(key, confidence)
-            if not res: return None
-            time.sleep(self.config.POLL_UI_VERIFY)
+    def frame_analysis(self, haystack):
+        """The snapshot's analysis, or a separate one for a frame grabbed just for a lookup, which never replaces it."""
+        for analysis in (self.analysis, self._lookup_analysis):
+            if analysis is not None and analysis.image is haystack:
+                return analysis
+        snapshot = haystack is self.snapshot
+        analysis = FrameAnalysis(
+            self.matcher, haystack, self.rescaler.variants_for(*haystack.size), self.config.CONF_LOOSE,
+            priors=self.priors, confidence_for=self.get_template_confidence, stats=self.vision_stats,
+            previous=self.analysis if snapshot else None, tile=self.config.TILE_SIZE if self.config.TILE_GATING else None,
+            max_dirty_share=self.config.TILE_MAX_DIRTY_SHARE, order_for=self.variant_stats.order,
+            pool=self.match_pool,
+        )
+        if not snapshot:
+            self._lookup_analysis = analysis
+            return analysis
+        self.analysis = analysis
+        if analysis.dirty is not None:
+            counts = self.tile_stats.setdefault(self.state, [0, 0])
+            counts[0] += int(analysis.dirty.size - analysis.dirty.sum())
+            counts[1] += int(analysis.dirty.size)
+        return analysis
+
+    def select_vision_backend(self, image):
+        """Keep the fastest backend that finds every calibration paste, timed once on the session's first frame."""
+        if not self.backend_auto or self._backend_calibrated:
+            return
+        self._backend_calibrated = True
+        jobs = [(k, tpls[self.variant_stats.order(k, tpls)[0]]) for k, tpls in self.rescaler.variants_for(*image.size).items() if tpls]
+        names = [name for name, backend in VISION_BACKENDS.items() if backend.available()]
+        if not jobs or len(names) < 2:
+            return
+        frame = image if isinstance(image, Frame) else Frame.from_image(image)
+        rng = np.random.default_rng(0)
+        # A crop twice the template's size keeps each paste cheap to score while leaving the pyramid room to work.
+        pastes = [(k, t, *paste_template(frame.rgb[:min(frame.height, 2 * t.height), :min(frame.width, 2 * t.width)], t, rng))
+                  for k, t in jobs if t.rgb is not None]
+
+        def finds(scores, spot, confidence):
+            x, y = spot
+            return scores is not None and scores[max(0, y - 1):y + 2, max(0, x - 1):x + 2].max() > confidence
+
+        hay = frame.haystack
+        saved, default = dict(self.matcher.stats), self.matcher.backend
+        timings, missed = {}, {}
+        for name in names:
+            self.matcher.backend = VISION_BACKENDS[name]
+            timings[name] = float("inf")
+            for _ in range(max(1, self.config.BACKEND_CALIBRATION_ROUNDS)):
+                start = time.perf_counter()
+                self.matcher.score_maps(hay, [t for _, t in jobs])
+                timings[name] = min(timings[name], time.perf_counter() - start)
+            missed[name] = [k for k, t, pasted, spot in pastes
+                            if not finds(self.matcher.score_map(pasted.haystack, t), spot, self.get_template_confidence(k))]
+        self.matcher.stats.clear()
+        self.matcher.stats.update(saved)
+        agreeing = [name for name in names if not missed[name]]
+        self.matcher.backend = VISION_BACKENDS[min(agreeing, key=timings.get)] if agreeing else default
+        logger.info(
+            f"VISION: backend calibration at {image.size[0]}x{image.size[1]} over {len(jobs)} templates: "
+            + ", ".join(f"{name} {timings[name] * 1000:.1f} ms" + (f" (missed {len(missed[name])}/{len(pastes)} pastes)" if missed[name] else "")
+                        for name in names)
+            + f"; using {self.matcher.backend.name}"
+        )
+
+    def record_frame_match_time(self, elapsed):
+        timing = self.frame_match_time
+        timing[0] += 1
+        timing[1] += elapsed
+        timing[2] = max(timing[2], elapsed)
+        if self.config.ALIGNMENT_MODE:
+            logger.debug(f"VISION: frame match pass {elapsed * 1000:.1f} ms ({self.match_mode()})")
+
+    def match_mode(self):
+        return "in-process" if self.match_pool is None else self.match_pool.describe()
+
+    def persist_vision_state(self, force=False):
+        now = time.time()
+        if not force and now - self._last_vision_state_save < self.config.VISION_STATE_SAVE_INTERVAL:
+            return
+        self._last_vision_state_save = now
+        self.vision_state["priors"] = self.priors.to_dict()
+        self.vision_state["variants"] = self.variant_stats.to_dict()
+        # Older versions saved the first window size seen as the reference; only an explicit one is trusted now.
+        self.vision_state.pop("reference_size", None)
+        try:
+            save_vision_state(self.config.VISION_STATE_PATH, self.vision_state)
+        except Exception as e:
+            logger.warning(f"VISION: could not save {self.config.VISION_STATE_PATH}: {e}")
+
+    def frame_template_keys(self):
+        keys = list(self.STATE_TEMPLATE_KEYS.get(self.state, []))
+        if time.time() - self._last_popup_check >= self.config.POLL_POPUP:
+            keys += self.POPUP_KEYS
+        return keys
+
+    def get_template_exit_confidence(self, key, enter=None):
+        """Threshold a key must stay above once present; below its enter threshold so a borderline score does not flicker."""
+        enter = enter or self.get_template_confidence(key)
+        c = {"ready": 0.93, "ingame_auto_on": 0.93, "ingame_auto_off": 0.93}
+        return min(enter, c.get(key, max(self.config.CONF_LOOSE, enter - self.config.HYSTERESIS_MARGIN)))
+
+    def match(self, key, confidence=None, haystack=None):
+        """find_image plus the best score and location seen for key on this snapshot, as a MatchResult."""
+        conf = confidence or self.get_template_confidence(key)
+        if haystack is None and self.region:
+            haystack = self.capture_for_lookup()
+            if haystack is None: return MatchResult(key, False, None, None, conf)
+        box = self.find_image(key, conf, haystack=haystack)
+        if not haystack or not self.region:
+            return MatchResult(key, box is not None, None, box, conf)
+        best = self.frame_analysis(haystack).best(key)
+        if best is None:
+            return MatchResult(key, box is not None, 0.0, box, conf)
+        t, x, y, score = best
+        return MatchResult(key, box is not None, score, box or pyscreeze.Box(x + self.region[0], y + self.region[1], t.width, t.height), conf)
+
+    def find_present(self, key, confidence=None, haystack=None):
+        """match() with enter/exit hysteresis, recording the score against the frame in the ring."""
+        enter = confidence or self.get_template_confidence(key)
+        if haystack is None and self.region:
+            haystack = self.capture_for_lookup()
+            if haystack is None: return MatchResult(key, False, None, None, enter)
+        present, seen = self._presence.get(key, (False, 0.0))
+        now = time.time()
+        held = present and now - seen <= self.config.HYSTERESIS_HOLD
+        res = self.match(key, self.get_template_exit_confidence(key, enter) if held else enter, haystack)
+        self._presence[key] = (bool(res), now if res else seen)
+        if haystack is not None and res.score is not None:
+            self.frame_ring.record(haystack, key, res.score)
         return res
 
+    def find_stable_image(self, key, confidence=None, frames=3):
+        """Box once key has been present on the last `frames` captured frames, spread over FRAME_STABILITY_MIN_SPAN."""
+        enter = confidence or self.get_template_confidence(key)
+        exit_conf = self.get_template_exit_confidence(key, enter)
+        window = self.config.FRAME_STABILITY_WINDOW
+        min_span = self.config.FRAME_STABILITY_MIN_SPAN if frames > 1 else 0.0
+        gap = min_span / max(1, frames - 1)
+        captured = 0
+        frame = self.snapshot
+        for _ in range(max(frames, self.config.FRAME_RING_SIZE)):
+            scores = self.frame_ring.scores(frame) if frame is not None else None
+            if scores is None or key in scores or time.time() - frame.captured_at > window:
+                # Already judged for key, or too old to count: the next sample has to be a new capture.
+                if frame is not None:
+                    pause = frame.captured_at + gap - time.time()
+                    if pause > 0: time.sleep(pause)
+                frame = self.capture_for_lookup()
+                if frame is None: break
+                self.frame_ring.push(frame)
+                captured += 1
+            res = self.find_present(key, confidence, frame)
+            if not res: break
+            streak, span = self.frame_ring.streak(key, enter, exit_conf, window)
+            if streak >= frames and span >= min_span:
+                if not captured: self.stability_from_ring += 1
+                self.stability_captures += captured
+                return res.box
+        self.stability_captures += captured
+        return None
+
     def find_all(self, key, confidence=0.8, haystack=None):
         if not self.region: return []
         try:
-            if haystack:
-                matches = []
-                for _, t in self.template_variants.get(key, []):
-                    try:
-                        found = pyautogui.locateAll(t, haystack, confidence=confidence)
-                        for r in found:
-                            matches.append(pyscreeze.Box(r.left + self.region[0], r.top + self.region[1], r.width, r.height))
-                    except Exception:
-                        continue
-                return matches
-            template_path = self.config.TEMPLATES.get(key, "") if self.config.TEMPLATES else ""
-            if template_path: return list(pyautogui.locateAllOnScreen(template_path, region=self.region, confidence=confidence))
-            return []
+            if haystack is None: haystack = self.capture_for_lookup()
+            if haystack is None: return []
+            boxes, scores = self.frame_analysis(haystack).detections(key, confidence)
+            boxes = boxes + [self.region[0], self.region[1], 0, 0]
+            # One box per cluster across all variants, handed back in raster order.
+            kept = boxes[suppress_overlaps(boxes, scores, self.config.NMS_OVERLAP)]
+            kept = kept[np.lexsort((kept[:, 0], kept[:, 1]))]
+            return [pyscreeze.Box(*map(int, b)) for b in kept]
         except Exception: return []
 
     def current_phase(self):
@@ -890,7 +2867,7 @@ class BBSBot:
         )
 
     def has_network_error_context(self, haystack=None):
-        return bool(self.find_image("network_title_error", haystack=haystack))
+        return bool(self.find_present("network_title_error", haystack=haystack))
 
     def close_room_fail_modal(self, haystack=None, reason="closed_room_coop_quest_menu"):
         if not (self.find_image("closed_room_coop_quest_menu", haystack=haystack) and self.find_image("unavailable_close", haystack=haystack)):
@@ -915,13 +2892,47 @@ class BBSBot:
             return True
         return False
 
-    def capture_snapshot(self):
+    def set_snapshot(self, frame):
+        # A new frame token invalidates every memoized find_image result.
+        self.snapshot = frame
+        if frame is not None:
+            self.frame_ring.push(frame)
+        self.frame_token += 1
+        self._find_cache.clear()
+        return frame
+
+    def wait_for_settle(self, reason, max_wait, roi=None):
+        """Sleep until the window settles, at most max_wait; returns the settled frame as the new snapshot, or None."""
+        if not self.config.SETTLE_DETECTION:
+            time.sleep(max_wait)
+            return None
+        frame = self.settle.wait(self.capture_for_lookup, reason, max_wait, roi)
+        if self.config.ALIGNMENT_MODE:
+            logger.info(f"SETTLE: {reason} settled, {self.settle.saved[reason][1]:.2f}s saved so far")
+        return self.set_snapshot(frame) if frame is not None else None
+
+    def find_cache_stats(self):
+        total = self.find_cache_hits + self.find_cache_misses
+        return self.find_cache_hits, self.find_cache_misses, (self.find_cache_hits / total if total else 0.0)
+
+    def grab_frame(self):
         if not self.region:
             return None
         monitor = {"top": self.region[1], "left": self.region[0], "width": self.region[2], "height": self.region[3]}
-        sct_img = self.sct.grab(monitor)
-        self.snapshot = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
-        return self.snapshot
+        self.mss_captures += 1
+        return Frame.from_grab(self.sct.grab(monitor))
+
+    def capture_snapshot(self):
+        frame = self.grab_frame()
+        return self.set_snapshot(frame) if frame is not None else None
+
+    def capture_for_lookup(self):
+        """A fresh frame for a lookup given none; leaves self.snapshot and the find cache alone, a failed grab is a miss."""
+        try:
+            return self.grab_frame()
+        except Exception as e:
+            logger.debug(f"VISION: capture for lookup failed: {e}")
+            return None
 
     def box_y_ratio(self, box):
         if not self.region:
@@ -940,7 +2951,7 @@ class BBSBot:
 
     def current_room_signature(self, autos):
         rows = []
-        for a in BBSBot.dedupe_autos(autos, self.config):
+        for a in autos:
             cy = a.top + a.height // 2
             rows.append(round(cy / self.config.ROOM_ROW_BUCKET) * self.config.ROOM_ROW_BUCKET)
         return tuple(sorted(rows))
@@ -989,7 +3000,7 @@ class BBSBot:
             self.transition_to("SCAN_ROOMS")
 
     def build_room_candidates(self, haystack=None):
-        autos = self.find_all("auto", haystack=haystack)
+        autos = BBSBot.dedupe_autos(self.find_all("auto", haystack=haystack), self.config)
         if not autos:
             return [], (), []
         signature = self.current_room_signature(autos)
@@ -1006,7 +3017,7 @@ class BBSBot:
             candidates.append((auto, rule, "strict"))
             matched_ids.add(id(auto))
         if self.config.ALLOW_ALL_AUTO_ROOMS:
-            for a in BBSBot.dedupe_autos(autos, self.config):
+            for a in autos:
                 if id(a) not in matched_ids and not BBSBot.has_invalid_room_rule(a, invalid_rules, self.config):
                     candidates.append((a, None, "fallback"))
         if invalid_count:
@@ -1014,6 +3025,7 @@ class BBSBot:
         return autos, signature, candidates
 
     def candidate_still_valid_before_click(self, row_y, mode):
+        # A fixed gap: the recheck has to give a rule change time to show, which a settled screen does not prove.
         time.sleep(self.config.ROOM_PRE_CLICK_RECHECK_GAP)
         snap = self.capture_snapshot()
         _, _, candidates = self.build_room_candidates(snap)
@@ -1077,43 +3089,49 @@ class BBSBot:
         # because those are real errors.
         blocked = ["close"] if self.state in ["ENTER_ROOM_LIST"] else []
         
-        if self.find_image("download_data_title", haystack=haystack) and self.find_image("download_data_yes", haystack=haystack):
+        button = self.find_present("download_data_title", haystack=haystack) and self.find_present("download_data_yes", haystack=haystack)
+        if button:
             logger.warning("GLOBAL: Download data prompt confirmed")
-            if self.smart_click("download_data_yes", "confirm download data", verify_key="download_data_yes", haystack=haystack):
+            if self.smart_click("download_data_yes", "confirm download data", verify_key="download_data_yes", confidence=button.confidence, haystack=haystack):
                 self.reset_quest_watchdog("download-data")
                 time.sleep(self.config.WAIT_DOWNLOAD_AFTER_CONFIRM)
                 self.transition_to("RECOVERY")
                 return True
 
-        if (
-            self.find_image("update_return_title", haystack=haystack)
-            and self.find_image("update_return_message", haystack=haystack)
-            and self.find_image("update_return_ok", haystack=haystack)
-        ):
+        button = (
+            self.find_present("update_return_title", haystack=haystack)
+            and self.find_present("update_return_message", haystack=haystack)
+            and self.find_present("update_return_ok", haystack=haystack)
+        )
+        if button:
             logger.warning("GLOBAL: Update return-to-title prompt confirmed")
-            if self.smart_click("update_return_ok", "dismiss update return prompt", verify_key="update_return_message", haystack=haystack):
+            if self.smart_click("update_return_ok", "dismiss update return prompt", verify_key="update_return_message", confidence=button.confidence, haystack=haystack):
                 self.reset_quest_watchdog("update-return")
                 self.transition_to("RECOVERY")
                 return True
 
-        if self.find_image("login_failed_title", haystack=haystack) and self.find_image("login_failed_ok", haystack=haystack):
+        button = self.find_present("login_failed_title", haystack=haystack) and self.find_present("login_failed_ok", haystack=haystack)
+        if button:
             logger.warning("GLOBAL: Login failed prompt confirmed")
-            if self.smart_click("login_failed_ok", "dismiss login failed", verify_key="login_failed_title", haystack=haystack):
+            if self.smart_click("login_failed_ok", "dismiss login failed", verify_key="login_failed_title", confidence=button.confidence, haystack=haystack):
                 self.transition_to("RECOVERY")
                 return True
 
-        if self.find_image("brave_bonus_title", haystack=haystack) and self.find_image("brave_bonus_cancel", haystack=haystack):
+        button = self.find_present("brave_bonus_title", haystack=haystack) and self.find_present("brave_bonus_cancel", haystack=haystack)
+        if button:
             logger.warning("GLOBAL: Brave Bonus prompt confirmed; canceling for later claim")
-            if self.smart_click("brave_bonus_cancel", "cancel brave bonus", verify_key="brave_bonus_cancel", haystack=haystack):
+            if self.smart_click("brave_bonus_cancel", "cancel brave bonus", verify_key="brave_bonus_cancel", confidence=button.confidence, haystack=haystack):
                 self.transition_to("RECOVERY")
                 return True
 
-        if self.find_image("player_rank_reward_title", haystack=haystack) and self.find_image("player_rank_reward_close", haystack=haystack):
+        button = self.find_present("player_rank_reward_title", haystack=haystack) and self.find_present("player_rank_reward_close", haystack=haystack)
+        if button:
             logger.warning("GLOBAL: Player Rank Reward prompt confirmed")
             if self.smart_click(
                 "player_rank_reward_close",
                 "dismiss player rank reward",
                 verify_key="player_rank_reward_title",
+                confidence=button.confidence,
                 haystack=haystack,
             ):
                 if self.state == "RECOVERY":
@@ -1121,10 +3139,11 @@ class BBSBot:
                 return True
 
         if self.has_network_error_context(haystack):
-            retry_key = "network_retry_button" if self.find_image("network_retry_button", haystack=haystack) else "disconnect_retry"
-            if self.find_image(retry_key, haystack=haystack):
+            retry_key = "network_retry_button" if self.find_present("network_retry_button", haystack=haystack) else "disconnect_retry"
+            button = self.find_present(retry_key, haystack=haystack)
+            if button:
                 logger.warning("GLOBAL: Network retry prompt confirmed")
-                if self.smart_click(retry_key, "network retry", verify_key=retry_key, haystack=haystack):
+                if self.smart_click(retry_key, "network retry", verify_key=retry_key, confidence=button.confidence, haystack=haystack):
                     self.disconnect_retry_count += 1
                     cool_time = random.randint(*self.config.WAIT_DISCONNECT_COOLING)
                     logger.warning(f"DISCONNECT: Cooling down for {cool_time}s...")
@@ -1142,13 +3161,12 @@ class BBSBot:
             if key in blocked: continue
             if key == "okay" and not self.is_safe_room_okay_context(haystack): continue
             
-            conf = self.get_template_confidence(key)
-
-            if self.find_image(key, confidence=conf, haystack=haystack):
+            button = self.find_present(key, haystack=haystack)
+            if button:
                 logger.warning(f"GLOBAL: Popup '{key}' confirmed")
                 if key == "close_news": time.sleep(self.config.DELAY_NEWS)
 
-                if not self.smart_click(key, f"dismiss {key}", verify_key=key, haystack=haystack):
+                if not self.smart_click(key, f"dismiss {key}", verify_key=key, confidence=button.confidence, haystack=haystack):
                     return False
 
                 # Realign with visible state instead of trusting stale state.
@@ -1221,8 +3239,7 @@ class BBSBot:
             return False
         
         # Stability Pause: Wait for room list to settle
-        time.sleep(0.4)
-        scan_haystack = self.capture_snapshot() or haystack
+        scan_haystack = self.wait_for_settle("room list", 0.4) or self.capture_snapshot() or haystack
         
         autos, signature, candidates = self.build_room_candidates(scan_haystack)
         if autos:
@@ -1262,7 +3279,7 @@ class BBSBot:
     @staticmethod
     def match_rooms(autos, rules, config):
         valid = []
-        for a in BBSBot.dedupe_autos(autos, config):
+        for a in autos:
             ax, ay = a.left + a.width // 2, a.top + a.height // 2
             best_r, min_d = None, float("inf")
             for r in rules:
@@ -1288,11 +3305,8 @@ class BBSBot:
 
     @staticmethod
     def dedupe_autos(matches, config):
-        unique = []
-        for m in matches:
-            cx, cy = m.left + m.width // 2, m.top + m.height // 2
-            if not any(((cx - (u.left + u.width // 2))**2 + (cy - (u.top + u.height // 2))**2)**0.5 < config.AUTO_ICON_DEDUPE_DIST for u in unique): unique.append(m)
-        return unique
+        centers = [(m.left + m.width // 2, m.top + m.height // 2) for m in matches]
+        return [matches[i] for i in suppress_near_centers(centers, config.AUTO_ICON_DEDUPE_DIST)]
 
     def handle_join_pending(self, haystack=None):
         ready_box = self.find_stable_image("ready", confidence=self.config.CONF_READY, frames=3)
@@ -1339,7 +3353,7 @@ class BBSBot:
         return False
 
     def run_started(self):
-        return self.find_stable_image("ingame_auto_on", frames=3) or self.find_stable_image("ingame_auto_off", frames=3)
+        return any(self.find_stable_image(key, frames=3) for key in self.RUN_START_KEYS)
 
     def handle_check_run_start(self, haystack=None):
         if self.run_started():
@@ -1361,12 +3375,12 @@ class BBSBot:
         for key in ["tap1", "tap2"]:
             if self.find_image(key, haystack=haystack):
                 if self.smart_click(key, f"reward {key}", haystack=haystack):
-                    time.sleep(self.config.WAIT_STABILIZE_ANIMATION)
+                    self.wait_for_settle("reward animation", self.config.WAIT_STABILIZE_ANIMATION)
                     return True
                 return False
         if self.find_image("retry", haystack=haystack):
             if self.smart_click("retry", "retry quest", verify_key="retry", verify_timeout=self.config.TIMEOUT_ROOM_LIST_LOAD, haystack=haystack):
-                time.sleep(self.config.WAIT_POST_RETRY)
+                self.wait_for_settle("post retry", self.config.WAIT_POST_RETRY)
                 if self.run_count >= self.next_distraction_run:
                     self.next_distraction_run = 9999
                     self.transition_to("DISTRACTION")
@@ -1474,6 +3488,21 @@ class BBSBot:
     def check_quest_watchdog(self):
         if time.time() - self.quest_watchdog > self.config.TIMEOUT_QUEST_MAX: self.recover_game("quest_watchdog")
 
+    def freeze_timeout(self):
+        return {
+            "RUNNING": self.config.FREEZE_TIMEOUT_RUNNING,
+            "GAME_STARTUP": self.config.FREEZE_TIMEOUT_GAME_STARTUP,
+        }.get(self.state)
+
+    def check_frozen_frame(self):
+        if not self.config.FREEZE_DETECTION or self.snapshot is None: return False
+        if not self.freeze.update(self.snapshot, self.state, self.freeze_timeout()): return False
+        logger.warning(f"WATCHDOG: {self.state} picture unchanged for {self.snapshot.captured_at - self.freeze.still_since:.0f}s; game looks hung. Restarting.")
+        self.freeze_recoveries += 1
+        self.freeze.reset()
+        self.recover_game(f"frozen_frame_{self.state.lower()}")
+        return True
+
     def ensure_window_ready(self):
         try:
             self.get_game_region()
@@ -1593,10 +3622,16 @@ class BBSBot:
 
                 self.ensure_game_visible_for_vision()
                 
-                monitor = {"top": self.region[1], "left": self.region[0], "width": self.region[2], "height": self.region[3]}
-                sct_img = self.sct.grab(monitor); self.snapshot = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+                self.capture_snapshot()
+                self.select_vision_backend(self.snapshot)
+                match_start = time.perf_counter()
+                # The pass scores these keys over the full window anyway, so a band scan first would only repeat work on a miss.
+                self.frame_analysis(self.snapshot).analyze(self.frame_template_keys(), banded=False)
+                self.record_frame_match_time(time.perf_counter() - match_start)
                 
                 self.check_quest_watchdog(); self.update_fatigue(); self.check_circadian_rhythm(); self.check_session_limit()
+                if self.check_frozen_frame(): continue
+                self.persist_vision_state()
                 if self.recovery_timed_out(): continue
                 if self.handle_global_popups(self.snapshot): continue
                 handler = self.handlers.get(self.state)
@@ -1621,6 +3656,13 @@ class BBSBot:
         elapsed = time.time() - self.start_time
         h, m, s = int(elapsed // 3600), int((elapsed % 3600) // 60), int(elapsed % 60)
         avg_run = (elapsed / 60.0) / max(1, self.run_count)
+        cache_hits, cache_misses, cache_rate = self.find_cache_stats()
+        self.persist_vision_state(force=True)
+        timing = self.frame_match_time
+        settle_saved = sum(saved for _, saved in self.settle.saved.values())
+        dead = self.variant_stats.dead(self.template_variants, self.config.VARIANT_DEAD_MIN_HITS)
+        for key, name in dead:
+            logger.info(f"VISION: variant {name} of {key} has never matched; consider retiring it")
         
         summary = (
             "\n" + "="*35 + "\n"
@@ -1630,6 +3672,20 @@ class BBSBot:
             f" ⚔️  Quests Cleared: {self.run_count}\n"
             f" ⚡  Avg Time/Run : {avg_run:.2f} mins\n"
             f" 🔌  Disconnects  : {self.disconnect_retry_count}\n"
+            f" 🧊  Frozen Frames: {self.freeze_recoveries} early restart(s)\n"
+            f" 🧠  Find Cache   : {cache_hits} hit / {cache_misses} miss ({cache_rate:.0%})\n"
+            f" 🎯  Search Bands : {self.vision_stats.get('prior_band', 0)} band / {self.vision_stats.get('prior_fallback', 0)} full-window\n"
+            f" 🎞️  Stability    : {self.stability_from_ring} confirmed from recent frames / {self.stability_captures} extra capture(s)\n"
+            f" ⏳  Settle Waits : {settle_saved:.1f}s saved ({settle_saved / max(1, self.run_count):.2f}s per run)\n"
+            + "".join(f"      {reason:<15}: {saved:.1f}s over {waits} wait(s)\n" for reason, (waits, saved) in sorted(self.settle.saved.items()))
+            + f" 📸  Captures     : {self.mss_captures} mss frames / {screenshot_counter.calls - self._screenshot_calls_at_start} screenshot-tool calls\n"
+            f" 🧪  Backend      : {self.matcher.backend.name} ({'calibrated' if self.backend_auto else 'pinned'})\n"
+            f" ⏱️  Frame Match  : {timing[1] / max(1, timing[0]) * 1000:.1f} ms avg / {timing[2] * 1000:.1f} ms worst over {timing[0]} frame(s), {self.match_mode()}\n"
+            f" 🎨  Colour Gate  : {self.vision_stats.get('color_rejects', 0)} searches skipped\n"
+            f" 🗂️  Variants     : {len(dead)} never matched (of {sum(len(v) for v in self.template_variants.values())})\n"
+            f" 🌱  Harvested    : {self.harvester.saved} candidate variant(s) staged / {self.harvester.duplicates} duplicate(s)\n"
+            f" 🧩  Dirty Tiles  : {self.vision_stats.get('tile_reused', 0)} reused / {self.vision_stats.get('tile_rescored', 0)} patched\n"
+            + "".join(f"      {state:<15}: {skipped / max(1, total):.0%} of tiles unchanged\n" for state, (skipped, total) in sorted(self.tile_stats.items()))
             + "="*35
         )
         logger.info(summary)
@@ -1644,6 +3700,19 @@ if __name__ == "__main__":
     parser.add_argument("--top-rooms-first", action="store_true")
     parser.add_argument("--no-refocus", action="store_true")
     parser.add_argument("--profile", choices=["max", "normal"], default="max")
+    parser.add_argument("--compile-templates", action="store_true", help="Write the precompiled template pack and exit")
+    parser.add_argument("--merge-templates", action="store_true", help="Fold _bk variants into <name>_masked.png templates where possible and exit")
+    parser.add_argument("--check-matcher", action="store_true", help="Compare the matcher's hits with OpenCV on templates pasted into synthetic frames and exit")
+    parser.add_argument("--template-reference-size", type=parse_window_size, help="Window size the templates were captured at, e.g. 806x482")
+    parser.add_argument("--rescale-cache-dir", help="Persist rescaled template sets for other window sizes here")
+    parser.add_argument("--no-color-gate", action="store_true", help="Disable the colour-histogram quick-reject gate")
+    parser.add_argument("--no-harvest", action="store_true", help="Do not stage near-miss crops as candidate template variants")
+    parser.add_argument("--no-settle-detection", action="store_true", help="Use the fixed animation sleeps instead of waiting for the screen to settle")
+    parser.add_argument("--no-freeze-detection", action="store_true", help="Leave hung-game detection to the quest watchdog alone")
+    parser.add_argument("--no-tile-gating", action="store_true", help="Re-match the whole window every frame instead of only changed tiles")
+    parser.add_argument("--match-workers", help="Worker processes for per-frame template matching: a count, or auto for one per CPU in the affinity set (0 matches in-process)")
+    parser.add_argument("--match-threads", help="Threads for per-frame template matching: a count, or auto for one per CPU in the affinity set")
+    parser.add_argument("--vision-backend", choices=["auto"] + list(VISION_BACKENDS), help="Template matching backend; auto benchmarks the available ones at startup")
     parser.add_argument("--cpu-affinity", help="Pin bot process to CPU cores, e.g. auto, 8-11, or 8,9,10,11")
     args = parser.parse_args()
     if args.cpu_affinity: apply_cpu_affinity(args.cpu_affinity)
@@ -1657,6 +3726,19 @@ if __name__ == "__main__":
     if args.short_coffee_breaks: config.DISTRACTION_DURATION = config.SHORT_DISTRACTION_DURATION
     if args.top_rooms_first: config.PREFER_BOTTOM_ROOMS = False
     if args.no_refocus: config.RESTORE_FOCUS_AFTER_CLICK = False
+    if args.no_color_gate: config.COLOR_GATE = False
+    if args.no_tile_gating: config.TILE_GATING = False
+    if args.no_settle_detection: config.SETTLE_DETECTION = False
+    if args.no_freeze_detection: config.FREEZE_DETECTION = False
+    if args.no_harvest: config.NEAR_MISS_HARVEST = False
+    if args.match_workers is not None: config.MATCH_WORKERS = parse_pool_size(args.match_workers)
+    if args.match_threads is not None: config.MATCH_THREADS = parse_pool_size(args.match_threads)
+    if args.vision_backend: config.VISION_BACKEND = args.vision_backend
+    if args.template_reference_size: config.TEMPLATE_REFERENCE_SIZE = args.template_reference_size
+    if args.rescale_cache_dir: config.RESCALE_CACHE_DIR = args.rescale_cache_dir
+    if args.merge_templates: merge_template_variants(config); sys.exit(0)
+    if args.compile_templates: compile_template_pack(config, config.TEMPLATE_PACK_PATH); sys.exit(0)
+    if args.check_matcher: sys.exit(1 if check_matcher_corpus(config) else 0)
     bot = BBSBot(config)
     try: bot.run(restart_game_on_start=args.test_restart)
     except KeyboardInterrupt: bot.log_session_summary(); sys.exit(0)
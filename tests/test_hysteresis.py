@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+import pytest
+
+bbs = pytest.importorskip("bbs_bot_v10")
+
+
+def scripted_bot(scores):
+    """A bot whose match() returns the given scores in turn; find_present's hysteresis runs on top of it."""
+    bot = bbs.BBSBot.__new__(bbs.BBSBot)
+    bot.config = bbs.BotConfiguration()
+    bot.region = (0, 0, 4, 4)
+    bot._presence = {}
+    bot.frame_ring = bbs.FrameRing(8)
+    feed = iter(scores)
+
+    def match(key, confidence=None, haystack=None):
+        score = next(feed)
+        return bbs.MatchResult(key, score > confidence, score, None, confidence)
+
+    bot.match = match
+    return bot
+
+
+def present(bot, key, frames):
+    return [bool(bot.find_present(key, haystack=frame)) for frame in frames]
+
+
+def frames(n):
+    return [bbs.Frame(np.zeros((4, 4, 3), dtype=np.uint8)) for _ in range(n)]
+
+
+def test_exit_threshold_sits_below_enter():
+    bot = scripted_bot([])
+    assert bot.get_template_confidence("tap1") == pytest.approx(0.90)
+    assert bot.get_template_exit_confidence("tap1") == pytest.approx(0.86)
+    assert bot.get_template_exit_confidence("ready") == pytest.approx(0.93)
+    assert bot.get_template_exit_confidence("tap1", enter=0.70) == pytest.approx(bot.config.CONF_LOOSE)
+
+
+def test_present_key_only_has_to_clear_exit():
+    bot = scripted_bot([0.88, 0.91, 0.88, 0.87, 0.85, 0.88, 0.91])
+    assert present(bot, "tap1", frames(7)) == [False, True, True, True, False, False, True]
+
+
+def test_hold_expires():
+    bot = scripted_bot([0.91, 0.88])
+    shots = frames(2)
+    assert bot.find_present("tap1", haystack=shots[0])
+    bot._presence["tap1"] = (True, time.time() - bot.config.HYSTERESIS_HOLD - 1)
+    assert not bot.find_present("tap1", haystack=shots[1])
+
+
+def test_scores_are_recorded_for_ring_frames():
+    bot = scripted_bot([0.91])
+    shot = frames(1)[0]
+    bot.frame_ring.push(shot)
+    result = bot.find_present("tap1", haystack=shot)
+    assert result and result.score == pytest.approx(0.91)
+    assert bot.frame_ring.scores(shot) == {"tap1": 0.91}
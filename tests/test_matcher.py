@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+bbs = pytest.importorskip("bbs_bot_v10")
+
+
+def textured(rng, width, height, cells=8):
+    small = (rng.random((max(1, height // cells), max(1, width // cells), 3)) * 255).astype(np.uint8)
+    return np.asarray(Image.fromarray(small).resize((width, height), Image.BILINEAR))
+
+
+def pasted(seed, tpl_size, frame_size=(200, 150), noise=0.0):
+    rng = np.random.default_rng(seed)
+    matcher = bbs.TemplateMatcher(bbs.BotConfiguration())
+    tpl = matcher.prepare(bbs.TemplateImage("tpl", textured(rng, *tpl_size, cells=4)))
+    frame, spot = bbs.paste_template(textured(rng, *frame_size), tpl, rng, noise)
+    return matcher, tpl, frame.haystack, spot
+
+
+@pytest.mark.parametrize("backend", ["numpy", "opencv"])
+def test_scores_match_cv2(backend):
+    cv2 = pytest.importorskip("cv2")
+    matcher, tpl, hay, (x, y) = pasted(1, (30, 20), noise=4.0)
+    matcher.backend = bbs.VISION_BACKENDS[backend]
+    expected = cv2.matchTemplate(hay.gray8, tpl.gray.astype(np.uint8), cv2.TM_CCOEFF_NORMED)
+    scores = matcher.score_maps(hay, [tpl])[0]
+    np.testing.assert_allclose(scores, expected, atol=1e-3)
+    assert np.unravel_index(int(np.argmax(scores)), scores.shape) == (y, x)
+    region = matcher.score_region(hay, tpl, (10, 20, 90, 70))
+    np.testing.assert_allclose(region, expected[20:70, 10:90], atol=1e-3)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "opencv"])
+def test_pyramid_finds_large_template(backend):
+    pytest.importorskip("cv2")
+    matcher, tpl, hay, (x, y) = pasted(2, (220, 200), frame_size=(480, 360))
+    matcher.backend = bbs.VISION_BACKENDS[backend]
+    assert matcher.pyramid_level(tpl) > 0
+    scores = matcher.score_maps(hay, [tpl])[0]
+    assert scores[y, x] > 0.99
+
+
+def test_colour_gate_skips_absent_template():
+    rng = np.random.default_rng(3)
+    matcher = bbs.TemplateMatcher(bbs.BotConfiguration())
+    tpl = matcher.prepare(bbs.TemplateImage("red", np.tile(np.array([220, 20, 20], np.uint8), (12, 16, 1))))
+    frame = bbs.Frame(np.repeat(textured(rng, 120, 90)[..., :1], 3, axis=2))
+    assert (matcher.score_maps(frame.haystack, [tpl])[0] == -1).all()
+
+
+def test_suppress_overlaps_keeps_best_of_each_cluster():
+    boxes = [(0, 0, 10, 10), (1, 1, 10, 10), (50, 50, 10, 10), (2, 0, 10, 10)]
+    scores = [0.80, 0.95, 0.70, 0.90]
+    assert bbs.suppress_overlaps(boxes, scores).tolist() == [1, 2]
+
+
+def test_suppress_overlaps_without_scores_keeps_first():
+    boxes = [(0, 0, 10, 10), (1, 1, 10, 10), (30, 0, 10, 10)]
+    assert bbs.suppress_overlaps(boxes).tolist() == [0, 2]
+    assert bbs.suppress_overlaps(np.empty((0, 4))).tolist() == []
+
+
+def test_suppress_overlaps_keeps_touching_boxes():
+    boxes = [(0, 0, 10, 10), (10, 0, 10, 10), (0, 7, 10, 10)]
+    # (0, 7) overlaps the first box by 30 / 170 of their union, above the 0.1 limit.
+    assert bbs.suppress_overlaps(boxes, [0.9, 0.8, 0.7], overlap=0.1).tolist() == [0, 1]
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+bbs = pytest.importorskip("bbs_bot_v10")
+
+
+@pytest.fixture
+def templates(tmp_path):
+    rng = np.random.default_rng(0)
+    images = tmp_path / "images"
+    images.mkdir()
+    paths = {}
+    for name, size in (("ready", (40, 20)), ("tap1", (60, 16)), ("tap1_bk1", (58, 16))):
+        path = images / f"{name}.png"
+        Image.fromarray((rng.random((size[1], size[0], 3)) * 255).astype(np.uint8)).save(path)
+        paths[name] = str(path)
+    config = bbs.BotConfiguration()
+    config.TEMPLATES = {"ready": paths["ready"], "tap1": paths["tap1"]}
+    return config, paths, str(tmp_path / "templates.pack")
+
+
+def test_pack_round_trip(templates):
+    config, paths, pack = templates
+    bbs.compile_template_pack(config, pack)
+    variants = bbs.load_template_pack(config, pack)
+    assert [t.path for t in variants["tap1"]] == [paths["tap1"], paths["tap1_bk1"]]
+    for key, path in config.TEMPLATES.items():
+        decoded = bbs.TemplateMatcher(config).prepare(bbs.load_template_image(path))
+        mapped = variants[key][0]
+        np.testing.assert_array_equal(mapped.gray, decoded.gray)
+        np.testing.assert_array_equal(mapped.dominant_colors, decoded.dominant_colors)
+        assert mapped.norm == pytest.approx(decoded.norm)
+
+
+def test_missing_pack_loads_nothing(templates):
+    config, _, pack = templates
+    assert bbs.load_template_pack(config, pack) is None
+
+
+def test_edited_template_makes_pack_stale(templates):
+    config, paths, pack = templates
+    bbs.compile_template_pack(config, pack)
+    Image.new("RGB", (40, 20), (10, 200, 30)).save(paths["ready"])
+    stat = os.stat(paths["ready"])
+    os.utime(paths["ready"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert bbs.load_template_pack(config, pack) is None
+
+
+def test_new_variant_makes_pack_stale(templates):
+    config, paths, pack = templates
+    bbs.compile_template_pack(config, pack)
+    images = os.path.dirname(paths["ready"])
+    stat = os.stat(images)
+    Image.new("RGB", (40, 20)).save(os.path.join(images, "ready_bk1.png"))
+    os.utime(images, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert bbs.load_template_pack(config, pack) is None
+
+
+def test_changed_matcher_params_make_pack_stale(templates):
+    config, _, pack = templates
+    bbs.compile_template_pack(config, pack)
+    config.COLOR_GATE_MIN_SHARE /= 2
+    assert bbs.load_template_pack(config, pack) is None
+
+
+def test_other_pack_version_is_rejected(templates):
+    config, _, pack = templates
+    bbs.compile_template_pack(config, pack)
+    with open(pack, "r+b") as f:
+        f.seek(len(bbs.TEMPLATE_PACK_MAGIC))
+        f.write((bbs.TEMPLATE_PACK_VERSION + 1).to_bytes(4, "little"))
+    assert bbs.load_template_pack(config, pack) is None